@@ -0,0 +1,427 @@
+"""
+ * Copyright (c) Contributors http://github.com/aduffy70/vMeadowGA
+ * See CONTRIBUTORS.TXT for a full list of copyright holders.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions are met:
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in the
+ *       documentation and/or other materials provided with the distribution.
+ *     * Neither the name of the vMeadowGA module nor the
+ *       names of its contributors may be used to endorse or promote products
+ *       derived from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE DEVELOPERS ``AS IS'' AND ANY
+ * EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+ * WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+ * DISCLAIMED. IN NO EVENT SHALL THE CONTRIBUTORS BE LIABLE FOR ANY
+ * DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+ * (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+ * LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ * ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+ * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import random
+import re
+try:
+    import numpy
+except ImportError:
+    #The app always has numpy, as one of its python27 runtime libraries (see app.yaml).  Only scripts run where it isn't installed (e.g. vMeadowSweep on a bare workstation) fall back to calculating cell by cell with precomputed neighbor tables, which is several times slower
+    numpy = None
+
+# Conversion tables for the "None", "Low", "Mid", "High" values on the webform (the same values vMeadowModule.cs uses)
+CONVERT_REPLACEMENT = {'N': 0.0, 'L': 0.02, 'M': 0.1, 'H': 0.2}
+CONVERT_LIFESPANS = {'S': 5, 'M': 10, 'L': 50}
+CONVERT_ALTITUDE_OPTIMUMS = {'L': 20.0, 'M': 35.0, 'H': 50.0}
+CONVERT_ALTITUDE_EFFECTS = {'N': 0.0, 'L': 0.17, 'M': 0.85, 'H': 1.5}
+CONVERT_SOIL_OPTIMUMS = {'L': 0.0, 'M': 0.5, 'H': 1.0}
+CONVERT_SOIL_EFFECTS = {'N': 0.0, 'L': 0.9, 'M': 0.5, 'H': 0.9}
+CONVERT_ONGOING_DISTURBANCE = {'N': 0.0, 'L': 0.005, 'M': 0.05, 'H': 0.2}
+
+# Dimensions of the community matrix.  Cells are indexed y * X_CELLS + x from the southwest corner, like the stored starting matrix.
+X_CELLS = 50
+Y_CELLS = 50
+CELLS = X_CELLS * Y_CELLS
+
+# Run-length encoded matrices (see encode_matrix) write gaps and plant types as letters so the run lengths can be written as digits
+ENCODED_CELL_VALUES = {'0': 'a', '1': 'b', '2': 'c', '3': 'd', '4': 'e', '5': 'f'}
+DECODED_CELL_VALUES = dict([(letter, value) for value, letter in ENCODED_CELL_VALUES.items()])
+ENCODED_RUN_PATTERN = re.compile('([0-9]*)([RNa-f])')
+# Run-length encoded matrices start with this, which a plain matrix never contains, so the two formats can't be confused
+ENCODED_MATRIX_PREFIX = '~'
+
+# Region water height.  Cells below it never hold plants.
+WATER_LEVEL = 20.0
+
+# Altitude of every cell when no terrain is given
+DEFAULT_ALTITUDE = 35.0
+
+# Share of the replacement probability from the 8 neighbors (divided by 8 here), from the rest of the community, and from outside the area
+LOCAL_REPLACEMENT = 0.9 / 8
+DISTANT_REPLACEMENT = 0.0995
+OUTSIDE_REPLACEMENT = 0.0005
+
+
+def encode_matrix(matrix):
+    """
+    Run-length encodes a plain matrix string (e.g. 2500 Rs becomes '~2500R').  Runs of one cell have no length.
+    """
+    encoded = [ENCODED_MATRIX_PREFIX]
+    run_start = 0
+    for i in range(1, len(matrix) + 1):
+        if ((i == len(matrix)) or (matrix[i] != matrix[run_start])):
+            run_length = i - run_start
+            if (run_length > 1):
+                encoded.append(str(run_length))
+            encoded.append(ENCODED_CELL_VALUES.get(matrix[run_start], matrix[run_start]))
+            run_start = i
+    return ''.join(encoded)
+
+
+def decode_matrix(matrix):
+    """
+    Returns the plain matrix string for a matrix in either format.  Only matrices starting with ENCODED_MATRIX_PREFIX are run-length encoded.  Others are plain and are returned unchanged.
+    """
+    if (matrix.startswith(ENCODED_MATRIX_PREFIX)):
+        return decode_runs(matrix)
+    return matrix
+
+
+def decode_runs(encoded):
+    """
+    Returns the plain matrix string for a run-length encoded matrix made by encode_matrix.  Every stored record and compact XML matrix starts with ENCODED_MATRIX_PREFIX, which is skipped because it isn't part of any run.
+    """
+    matrix = []
+    for run_length, value in ENCODED_RUN_PATTERN.findall(encoded):
+        matrix.append(DECODED_CELL_VALUES.get(value, value) * int(run_length or 1))
+    return ''.join(matrix)
+
+
+def neighbor_table():
+    """
+    Returns the indexes of the (up to 8) neighbors of each cell.  Edge cells have fewer neighbors.
+    """
+    neighbors = []
+    for y in range(Y_CELLS):
+        for x in range(X_CELLS):
+            cell_neighbors = []
+            for neighbor_y in (y - 1, y, y + 1):
+                for neighbor_x in (x - 1, x, x + 1):
+                    if (((neighbor_x, neighbor_y) != (x, y)) and (0 <= neighbor_x < X_CELLS) and (0 <= neighbor_y < Y_CELLS)):
+                        cell_neighbors.append(neighbor_y * X_CELLS + neighbor_x)
+            neighbors.append(cell_neighbors)
+    return neighbors
+
+
+NEIGHBORS = neighbor_table()
+
+
+def clamp(value):
+    """
+    Limits a health value to 0-1.0.
+    """
+    if (value > 1.0):
+        return 1.0
+    if (value < 0.0):
+        return 0.0
+    return value
+
+
+class MeadowCommunity():
+    """
+    Species parameters of a community, converted from the webform values in a record's properties.  Parameters a record doesn't have (e.g. disturbance only records) keep the defaults the region module starts with.
+    """
+    def __init__(self, parameters):
+        #Replacement matrix.  replacement[1][2] is the probability species 2 is replaced by species 1 if it is entirely surrounded by species 1.  Column 0 is colonization of gaps.
+        self.replacement = [[0.0] * 6] + [[0.4, 0.1, 0.1, 0.1, 0.1, 0.1] for species in range(5)]
+        self.lifespans = [0, 25, 25, 25, 25, 25]
+        self.altitude_optimums = [0.0, 35.0, 35.0, 35.0, 35.0, 35.0]
+        self.altitude_effects = [0.0] * 6
+        self.salinity_optimums = [0.0, 0.5, 0.5, 0.5, 0.5, 0.5]
+        self.salinity_effects = [0.0] * 6
+        self.drainage_optimums = [0.0, 0.5, 0.5, 0.5, 0.5, 0.5]
+        self.drainage_effects = [0.0] * 6
+        self.fertility_optimums = [0.0, 0.5, 0.5, 0.5, 0.5, 0.5]
+        self.fertility_effects = [0.0] * 6
+        for name, table in (('lifespans', CONVERT_LIFESPANS),
+                            ('altitude_optimums', CONVERT_ALTITUDE_OPTIMUMS),
+                            ('altitude_effects', CONVERT_ALTITUDE_EFFECTS),
+                            ('salinity_optimums', CONVERT_SOIL_OPTIMUMS),
+                            ('salinity_effects', CONVERT_SOIL_EFFECTS),
+                            ('drainage_optimums', CONVERT_SOIL_OPTIMUMS),
+                            ('drainage_effects', CONVERT_SOIL_EFFECTS),
+                            ('fertility_optimums', CONVERT_SOIL_OPTIMUMS),
+                            ('fertility_effects', CONVERT_SOIL_EFFECTS)):
+            if (parameters.get(name)):
+                values = getattr(self, name)
+                for species, value in enumerate(parameters[name].split(',')):
+                    values[species + 1] = table[value]
+        for species in range(1, 6):
+            if (parameters.get('replacement_%d' % species)):
+                for current, value in enumerate(parameters['replacement_%d' % species].split(',')):
+                    self.replacement[species][current] = CONVERT_REPLACEMENT[value]
+                #Make colonization events more likely than replacement events
+                self.replacement[species][0] *= 4.0
+
+    def environment_health(self, species, altitude, salinity, drainage, fertility):
+        """
+        Returns the part of the survival probability of a plant that depends on its environment (everything but its age).
+        """
+        altitude_health = clamp(1.0 - abs((self.altitude_optimums[species] - altitude) / 50.0) * self.altitude_effects[species])
+        salinity_health = clamp(1.0 - abs(self.salinity_optimums[species] - salinity) * self.salinity_effects[species])
+        drainage_health = clamp(1.0 - abs(self.drainage_optimums[species] - drainage) * self.drainage_effects[species])
+        fertility_health = clamp(1.0 - abs(self.fertility_optimums[species] - fertility) * self.fertility_effects[species])
+        return altitude_health * salinity_health * drainage_health * fertility_health
+
+
+class MeadowEnvironment():
+    """
+    Altitude and soil values (salinity, drainage and fertility, 0-1.0) of each cell.  Without a terrain every cell is land at DEFAULT_ALTITUDE, and without soil values they are 0, as in a region without the soil module.
+    """
+    def __init__(self, altitudes=None, salinity=None, drainage=None, fertility=None, water_level=WATER_LEVEL):
+        self.altitudes = altitudes or [DEFAULT_ALTITUDE] * CELLS
+        self.salinity = salinity or [0.0] * CELLS
+        self.drainage = drainage or [0.0] * CELLS
+        self.fertility = fertility or [0.0] * CELLS
+        self.water_level = water_level
+
+    def is_land(self, cell):
+        return self.altitudes[cell] >= self.water_level
+
+    def health(self, community):
+        """
+        Returns the environmental health of each species (rows 1-5, row 0 for gaps is all 0) in each cell.  Calculated as whole-grid numpy array operations, as it always is in the app, or cell by cell where numpy isn't installed.
+        """
+        if (numpy is not None):
+            return self.health_numpy(community)
+        health = [[0.0] * CELLS]
+        for species in range(1, 6):
+            health.append([community.environment_health(species, self.altitudes[cell], self.salinity[cell],
+                                                        self.drainage[cell], self.fertility[cell])
+                           for cell in range(CELLS)])
+        return health
+
+    def health_numpy(self, community):
+        """
+        Returns the same environmental health as health, calculated for all cells at once.
+        """
+        altitudes = numpy.array(self.altitudes, dtype=float)
+        soils = [(numpy.array(getattr(self, name), dtype=float), getattr(community, '%s_optimums' % name), getattr(community, '%s_effects' % name))
+                 for name in ('salinity', 'drainage', 'fertility')]
+        health = [[0.0] * CELLS]
+        for species in range(1, 6):
+            species_health = numpy.clip(1.0 - numpy.abs((community.altitude_optimums[species] - altitudes) / 50.0) * community.altitude_effects[species], 0.0, 1.0)
+            for values, optimums, effects in soils:
+                species_health = species_health * numpy.clip(1.0 - numpy.abs(optimums[species] - values) * effects[species], 0.0, 1.0)
+            health.append(species_health.tolist())
+        return health
+
+
+class MeadowSimulation():
+    """
+    Runs the vMeadowModule.cs cellular automaton for a record's parameters.  Each generation, disturbed cells become gaps, surviving plants may be replaced by a neighboring or distant species, and gaps may be colonized.  Uses whole-grid numpy array operations (see step_numpy), as it always does in the app.  step is the cell by cell fallback for scripts run where numpy isn't installed, or with use_numpy=False.
+    """
+    def __init__(self, parameters, seed=None, environment=None, use_numpy=True):
+        self.community = MeadowCommunity(parameters)
+        if (environment is None):
+            environment = MeadowEnvironment()
+        self.disturbance_rate = CONVERT_ONGOING_DISTURBANCE.get(parameters.get('ongoing_disturbance') or 'N', 0.0)
+        self.use_numpy = use_numpy and (numpy is not None)
+        self.random = random.Random(seed)
+        self.health = environment.health(self.community)
+        starting_matrix = parameters.get('starting_matrix') or 'R' * CELLS
+        status = []
+        age = []
+        permanent = []
+        counts = [0] * 6
+        for cell in range(CELLS):
+            value = starting_matrix[cell]
+            species = 0
+            cell_age = 0
+            if (not environment.is_land(cell)):
+                #Permanent gap
+                species = -1
+            elif (value == 'N'):
+                #There will never be a plant here (and it isn't counted in the first generation)
+                permanent.append(cell)
+            else:
+                if (value == 'R'):
+                    species = self.random.randrange(6)
+                else:
+                    species = int(value)
+                if (self.community.lifespans[species] > 0):
+                    cell_age = self.random.randrange(self.community.lifespans[species])
+                counts[species] += 1
+            status.append(species)
+            age.append(cell_age)
+        #The number of possible plant locations doesn't change over the simulation
+        self.active_cells = sum(counts)
+        self.counts = [counts]
+        if (self.use_numpy):
+            self.numpy_random = numpy.random.RandomState(self.random.randrange(2 ** 31))
+            self.status = numpy.array(status, dtype=numpy.int8)
+            self.age = numpy.array(age, dtype=numpy.int32)
+            self.permanent = numpy.zeros(CELLS, dtype=bool)
+            self.permanent[permanent] = True
+            self.active = self.status != -1
+            self.health_array = numpy.array(self.health)
+            #Gap lifespans are never used but must not divide by zero
+            self.lifespan_array = numpy.array([1] + self.community.lifespans[1:], dtype=float)
+            self.replacement_array = numpy.array(self.community.replacement)
+            self.cell_indexes = numpy.arange(CELLS)
+        else:
+            self.status = status
+            self.age = age
+            self.permanent = [False] * CELLS
+            for cell in permanent:
+                self.permanent[cell] = True
+
+    def distant_replacement(self):
+        """
+        Returns the part of each species' replacement probability from the rest of the community, which is the same for every cell.
+        """
+        counts = self.counts[-1]
+        if (self.active_cells == 0):
+            return [0.0] * 6
+        return [0.0] + [counts[species] / float(self.active_cells) * DISTANT_REPLACEMENT for species in range(1, 6)]
+
+    def run(self, generations):
+        """
+        Advances the simulation until it has the given number of generations (including the starting generation).
+        """
+        while (len(self.counts) < generations):
+            if (self.use_numpy):
+                self.step_numpy()
+            else:
+                self.step()
+
+    def step(self):
+        """
+        Calculates the next generation cell by cell, without numpy.
+        """
+        rand = self.random.random
+        status = self.status
+        age = self.age
+        permanent = self.permanent
+        health = self.health
+        lifespans = self.community.lifespans
+        replacement = self.community.replacement
+        disturbance_rate = self.disturbance_rate
+        distant = self.distant_replacement()
+        next_status = [-1] * CELLS
+        next_age = [0] * CELLS
+        counts = [0] * 6
+        for cell in range(CELLS):
+            species = status[cell]
+            if (species == -1):
+                continue
+            if (permanent[cell] or (rand() <= disturbance_rate)):
+                next_status[cell] = 0
+                counts[0] += 1
+                continue
+            neighbor_counts = [0] * 6
+            for neighbor in NEIGHBORS[cell]:
+                neighbor_species = status[neighbor]
+                if (neighbor_species != -1):
+                    neighbor_counts[neighbor_species] += 1
+            survives = False
+            if (species != 0):
+                lifespan = lifespans[species]
+                survives = rand() <= clamp((lifespan - age[cell]) / float(lifespan)) * health[species][cell]
+            if (survives):
+                current = species
+            else:
+                current = 0
+            #Select a replacement with a single random number against the cumulative probabilities
+            random_replacement = rand()
+            cumulative = 0.0
+            new_species = -1
+            for candidate in range(1, 6):
+                probability = replacement[candidate][current]
+                cumulative += (probability * neighbor_counts[candidate] * LOCAL_REPLACEMENT) + (probability * distant[candidate]) + OUTSIDE_REPLACEMENT
+                if (random_replacement <= cumulative):
+                    new_species = candidate
+                    break
+            if (new_species == -1):
+                next_status[cell] = current
+                if (survives):
+                    next_age[cell] = age[cell] + 1
+            else:
+                next_status[cell] = new_species
+            counts[next_status[cell]] += 1
+        self.status = next_status
+        self.age = next_age
+        self.counts.append(counts)
+
+    def step_numpy(self):
+        """
+        Calculates the next generation with whole-grid array operations.
+        """
+        status = self.status
+        grid = status.reshape(Y_CELLS, X_CELLS)
+        padded = numpy.zeros((6, Y_CELLS + 2, X_CELLS + 2))
+        for species in range(1, 6):
+            padded[species, 1:-1, 1:-1] = (grid == species)
+        neighbor_counts = numpy.zeros((6, Y_CELLS, X_CELLS))
+        for y_offset in (0, 1, 2):
+            for x_offset in (0, 1, 2):
+                if ((y_offset, x_offset) != (1, 1)):
+                    neighbor_counts += padded[:, y_offset:y_offset + Y_CELLS, x_offset:x_offset + X_CELLS]
+        neighbor_counts = neighbor_counts.reshape(6, CELLS)
+        disturbed = self.active & (self.permanent | (self.numpy_random.random_sample(CELLS) <= self.disturbance_rate))
+        plants = numpy.maximum(status, 0)
+        lifespans = self.lifespan_array[plants]
+        survival = numpy.clip((lifespans - self.age) / lifespans, 0.0, 1.0) * self.health_array[plants, self.cell_indexes]
+        survives = (status > 0) & (self.numpy_random.random_sample(CELLS) <= survival)
+        current = numpy.where(survives, status, 0)
+        probabilities = self.replacement_array[1:, current]
+        distant = numpy.array(self.distant_replacement()[1:])
+        cumulative = (probabilities * neighbor_counts[1:] * LOCAL_REPLACEMENT + probabilities * distant[:, None] + OUTSIDE_REPLACEMENT).cumsum(axis=0)
+        selected = self.numpy_random.random_sample(CELLS) <= cumulative
+        replaced = selected.any(axis=0)
+        next_status = numpy.where(replaced, selected.argmax(axis=0) + 1, current).astype(numpy.int8)
+        next_age = numpy.where(survives & ~replaced, self.age + 1, 0).astype(numpy.int32)
+        next_status[disturbed] = 0
+        next_age[disturbed] = 0
+        next_status[~self.active] = -1
+        self.status = next_status
+        self.age = next_age
+        self.counts.append([int(count) for count in numpy.bincount(next_status[self.active], minlength=6)])
+
+    def get_state(self):
+        """
+        Returns the species counts so far and the state after the last generation, for resuming the simulation later with the same parameters (see set_state).
+        """
+        state = {'counts': self.counts,
+                 'status': [int(species) for species in self.status],
+                 'age': [int(cell_age) for cell_age in self.age],
+                 'random': self.random.getstate()}
+        if (self.use_numpy):
+            state['numpy_random'] = self.numpy_random.get_state()
+        return state
+
+    def set_state(self, state):
+        """
+        Continues from a state returned by get_state.  Runs resumed with the same calculation (numpy or not) give the same results as uninterrupted runs.
+        """
+        self.counts = [list(counts) for counts in state['counts']]
+        self.random.setstate(state['random'])
+        if (self.use_numpy):
+            self.status = numpy.array(state['status'], dtype=numpy.int8)
+            self.age = numpy.array(state['age'], dtype=numpy.int32)
+            if ('numpy_random' in state):
+                self.numpy_random.set_state(state['numpy_random'])
+        else:
+            self.status = list(state['status'])
+            self.age = list(state['age'])
+
+    def log_rows(self, first_step=0):
+        """
+        Returns the species counts from first_step on as "step,gaps,species1,...,species5" strings (the vpcsimlog data format).
+        """
+        return ['%d,%s' % (step, ','.join([str(count) for count in self.counts[step]]))
+                for step in range(first_step, len(self.counts))]
@@ -29,7 +29,77 @@ import cgi
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 from google.appengine.ext import db
-import time
+from google.appengine.api import datastore
+from google.appengine.api import memcache
+import hashlib
+import json
+import pickle
+import urllib
+import zlib
+import vMeadowEngine
+import vMeadowMaps
+
+# Number of serialized records kept in each instance's in-process cache
+XML_CACHE_SIZE = 200
+
+
+class LruCache():
+    """
+    Small in-process least recently used cache.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.values = {}
+        self.order = []
+
+    def get(self, key):
+        if (key not in self.values):
+            return None
+        self.order.remove(key)
+        self.order.append(key)
+        return self.values[key]
+
+    def put(self, key, value):
+        if (key in self.values):
+            self.order.remove(key)
+        elif (len(self.order) >= self.size):
+            del self.values[self.order.pop(0)]
+        self.values[key] = value
+        self.order.append(key)
+
+
+# Length of record ids (the simulation ids regions log with)
+RECORD_ID_LENGTH = 10
+
+# Number of cells in the community matrix
+MATRIX_CELLS = 2500
+
+# Number of generations (including the starting generation) simulated for a preview, by default and at most
+DEFAULT_PREVIEW_GENERATIONS = 200
+MAX_PREVIEW_GENERATIONS = 1000
+
+# Number of preview results kept in each instance's in-process cache
+PREVIEW_CACHE_SIZE = 50
+
+# Changing the simulation engine in a way that changes its results must change this, so cached previews are not reused
+PREVIEW_ENGINE_VERSION = 2
+
+# Number of suitability grids kept in each instance's in-process cache
+SUITABILITY_CACHE_SIZE = 50
+
+# Record and form properties the suitability grids depend on
+SUITABILITY_PARAMETERS = ('terrain', 'salinity', 'drainage', 'fertility', 'altitude_optimums', 'altitude_effects',
+                          'salinity_optimums', 'salinity_effects', 'drainage_optimums', 'drainage_effects',
+                          'fertility_optimums', 'fertility_effects')
+
+# (etag, xml) for recently requested records.  Records never change once stored so entries never go stale.
+xml_cache = LruCache(XML_CACHE_SIZE)
+
+# Simulation engine state (see vMeadowEngine.MeadowSimulation.get_state) for recent previews, by preview key
+preview_cache = LruCache(PREVIEW_CACHE_SIZE)
+
+# Suitability grids (see vMeadowMaps.suitability) for recently requested parameters, by suitability key
+suitability_cache = LruCache(SUITABILITY_CACHE_SIZE)
 
 
 class HtmlPage():
@@ -95,7 +165,7 @@ class MeadowRecordObject(db.Model):
     """
     Record class representing all the parameters to run a community simulation.
     """
-    # Timestamp id for this record
+    # Id for this record (a timestamp for older records, allocated for newer ones)
     id = db.StringProperty()
 
     # CSV integers represeting the OpenMetaverse Tree types for each of the 5 species in the community
@@ -148,8 +218,12 @@ class MeadowRecordObject(db.Model):
     fertility = db.IntegerProperty()
 
     #Matrix representing the starting values for each position in the matrix (R=random, N=disturbance, 0=gap, 1-5=plant types)
+    #Only older records store it plain.  Newer records store encoded_starting_matrix instead.
     starting_matrix = db.TextProperty()
 
+    #Run-length encoded starting matrix (see vMeadowEngine.encode_matrix)
+    encoded_starting_matrix = db.TextProperty()
+
     #Ongoing disturbance rate (random temporary disturbance each generation in addition to the permanent disturbance on the starting matrix) (N=none, L=low, M=mid, H=high)
     ongoing_disturbance = db.StringProperty()
 
@@ -166,6 +240,151 @@ class MeadowRecordObject(db.Model):
     #Note- currently locked a 5
     spacing = db.FloatProperty()
 
+    def get_starting_matrix(self):
+        """
+        Returns the plain starting matrix for either storage format.
+        """
+        if (self.encoded_starting_matrix):
+            return vMeadowEngine.decode_runs(self.encoded_starting_matrix)
+        return self.starting_matrix or ''
+
+    def to_region_xml(self, output_format):
+        """
+        Returns the record as XML for a region module.  The 'plain' format has only starting_matrix, as existing region modules expect, and the 'compact' format has only encoded_starting_matrix.  The XML is built from a copy of the stored entity, so the record itself is left unchanged.
+        """
+        starting_matrix = self.get_starting_matrix()
+        entity = datastore.Entity.FromPb(db.model_to_protobuf(self))
+        for name in ('starting_matrix', 'encoded_starting_matrix'):
+            if (name in entity):
+                del entity[name]
+        if (output_format == 'compact'):
+            entity['encoded_starting_matrix'] = db.Text(vMeadowEngine.encode_matrix(starting_matrix))
+        else:
+            entity['starting_matrix'] = db.Text(starting_matrix)
+        return entity.ToXml()
+
+    def simulation_parameters(self):
+        """
+        Returns the record's properties used by the simulation engine, with the plain starting matrix.
+        """
+        parameters = {}
+        for name in ('terrain', 'salinity', 'drainage', 'fertility', 'replacement_1', 'replacement_2', 'replacement_3', 'replacement_4', 'replacement_5',
+                     'lifespans', 'altitude_optimums', 'altitude_effects', 'salinity_optimums',
+                     'salinity_effects', 'drainage_optimums', 'drainage_effects', 'fertility_optimums',
+                     'fertility_effects', 'ongoing_disturbance'):
+            parameters[name] = getattr(self, name)
+        parameters['starting_matrix'] = self.get_starting_matrix()
+        return parameters
+
+
+def record_key_name(id):
+    """
+    Key name of the MeadowRecordObject with an id (key names can't start with a digit).
+    """
+    return 'id:%s' % id
+
+
+def allocate_record_id():
+    """
+    Returns a new record id.  Ids come from the datastore id allocator so concurrent submissions never share one.  They are zero padded to RECORD_ID_LENGTH characters because regions log simulations by record id and vpcsimlog only accepts 10 character ids.  Allocated ids stay far below 10**9, so padded ids start with 0 and can't collide with the 10 digit timestamp ids of older records.
+    """
+    first_id, last_id = db.allocate_ids(db.Key.from_path('MeadowRecordObject', 1), 1)
+    if (first_id >= 10 ** (RECORD_ID_LENGTH - 1)):
+        raise ValueError('Allocated record id %d is too large to pad to %d characters' % (first_id, RECORD_ID_LENGTH))
+    return '%0*d' % (RECORD_ID_LENGTH, first_id)
+
+
+def get_record(id):
+    """
+    Returns the MeadowRecordObject with an id, or None.  Records stored before they were keyed by id are found with a query.
+    """
+    record = MeadowRecordObject.get_by_key_name(record_key_name(id))
+    if (record is None):
+        records = db.GqlQuery("SELECT * FROM MeadowRecordObject WHERE id=:1", id).fetch(1)
+        if (records):
+            record = records[0]
+    return record
+
+
+class PreviewResult(db.Model):
+    """
+    Stored result of a preview simulation, keyed by its preview key.
+    """
+    # Number of generations simulated
+    generations = db.IntegerProperty()
+
+    # zlib compressed pickle of the simulation engine state, which includes the species counts of each generation
+    state = db.BlobProperty()
+
+
+def preview_key(parameters, seed):
+    """
+    Returns a hash identifying the simulation of a set of parameters with a seed.  Records with the same parameters share previews.
+    """
+    canonical = [u'engine=%d' % PREVIEW_ENGINE_VERSION, u'seed=%d' % seed]
+    for name in sorted(parameters.keys()):
+        canonical.append(u'%s=%s' % (name, parameters[name] or ''))
+    return hashlib.sha1(u'\n'.join(canonical).encode('utf-8')).hexdigest()
+
+
+def run_preview(parameters, seed, generations):
+    """
+    Returns the species counts of each generation of a preview simulation.  Earlier results for the same parameters and seed are reused from the in-process cache or the datastore, and resumed from their last generation if they are too short.
+    """
+    key = preview_key(parameters, seed)
+    state = preview_cache.get(key)
+    if (state is None):
+        result = PreviewResult.get_by_key_name('preview:%s' % key)
+        if (result is not None):
+            state = pickle.loads(zlib.decompress(result.state))
+            preview_cache.put(key, state)
+    if ((state is not None) and (len(state['counts']) >= generations)):
+        return state['counts'][:generations]
+    simulation = vMeadowEngine.MeadowSimulation(parameters, seed, vMeadowMaps.record_environment(parameters))
+    if (state is not None):
+        simulation.set_state(state)
+    simulation.run(generations)
+    state = simulation.get_state()
+    preview_cache.put(key, state)
+    PreviewResult(key_name='preview:%s' % key, generations=generations,
+                  state=zlib.compress(pickle.dumps(state, 2))).put()
+    return state['counts']
+
+
+def form_suitability_parameters(request):
+    """
+    Returns the properties the suitability grids depend on from the fields of the parameters form, joined for the five species as store_record joins them.
+    """
+    parameters = {}
+    for name in ('terrain', 'salinity', 'drainage', 'fertility'):
+        parameters[name] = request.get(name)
+    for name in SUITABILITY_PARAMETERS[4:]:
+        parameters[name] = ','.join([request.get('%s_%s' % (name[:-1], species)) for species in range(1, 6)])
+    return parameters
+
+
+def suitability_key(parameters):
+    """
+    Returns a hash identifying the suitability grids of a set of parameters.
+    """
+    canonical = [u'%s=%s' % (name, parameters.get(name) or '') for name in SUITABILITY_PARAMETERS]
+    return hashlib.sha1(u'\n'.join(canonical).encode('utf-8')).hexdigest()
+
+
+def get_suitability(parameters):
+    """
+    Returns the suitability grids for a set of parameters from the in-process cache, memcache, or by calculating them.
+    """
+    key = suitability_key(parameters)
+    grid = suitability_cache.get(key)
+    if (grid is None):
+        grid = memcache.get('suitability:%s' % key)
+        if (grid is None):
+            grid = vMeadowMaps.suitability(parameters)
+            memcache.set('suitability:%s' % key, grid)
+        suitability_cache.put(key, grid)
+    return grid
+
 
 class ParametersFormPageOne(webapp.RequestHandler):
     """
@@ -386,12 +605,101 @@ class ParametersFormPageTwo(webapp.RequestHandler):
 
 class GetParameters(webapp.RequestHandler):
     """
-    Returns the community record with a particular timestamp as XML.  Accessed by the vMeadow opensim module.
+    Returns the community record with a particular id as XML, with a plain starting matrix or, given format=compact, a run-length encoded one.  Accessed by the vMeadow opensim module.  Records never change once stored, so the XML is cached in the instance and in memcache, and requests repeating the ETag get 304 Not Modified.
+    """
+    def get(self):
+        id = self.request.get('id')
+        output_format = self.request.get('format', 'plain')
+        if (output_format != 'compact'):
+            output_format = 'plain'
+        cache_key = '%s:%s' % (output_format, id)
+        cached = xml_cache.get(cache_key)
+        if (cached is None):
+            cached = memcache.get('meadowxml:%s' % cache_key)
+            if (cached is None):
+                record = get_record(id)
+                if (record is None):
+                    self.error(404)
+                    return
+                xml = record.to_region_xml(output_format)
+                if (isinstance(xml, unicode)):
+                    xml = xml.encode('utf-8')
+                cached = ('"%s"' % hashlib.md5(xml).hexdigest(), xml)
+                memcache.set('meadowxml:%s' % cache_key, cached)
+            xml_cache.put(cache_key, cached)
+        etag, xml = cached
+        self.response.headers['ETag'] = etag
+        if_none_match = self.request.headers.get('If-None-Match', '')
+        if (etag in [tag.strip() for tag in if_none_match.split(',')]):
+            self.response.set_status(304)
+            return
+        self.response.out.write(xml)
+
+
+class PreviewSimulation(webapp.RequestHandler):
+    """
+    Runs the community simulation for a record and returns the species counts of each generation as CSV, in the same step format the region logs.  Accepts 'generations' and 'seed' (the same seed gives the same preview).  Results are cached (see run_preview).  Accessed by the user by url.
+    """
+    def get(self):
+        record = get_record(self.request.get('id'))
+        if (record is None):
+            self.error(404)
+            return
+        try:
+            generations = int(self.request.get('generations', DEFAULT_PREVIEW_GENERATIONS))
+            seed = int(self.request.get('seed', 0))
+        except ValueError:
+            self.error(400)
+            return
+        generations = max(1, min(generations, MAX_PREVIEW_GENERATIONS))
+        counts = run_preview(record.simulation_parameters(), seed, generations)
+        self.response.headers['Content-Type'] = 'text/csv'
+        self.response.out.write('step,gaps,species1,species2,species3,species4,species5\n')
+        for step in range(len(counts)):
+            self.response.out.write('%d,%s\n' % (step, ','.join([str(count) for count in counts[step]])))
+
+
+class SuitabilityMap(webapp.RequestHandler):
+    """
+    Returns where each species can thrive on a record's terrain and soil maps, as the environmental health (the same modifier the region applies to survival) of each species in each cell.  Given format=png and a species (1-5), returns a 50x50 PNG overlay for that species, otherwise JSON with a list of cells (indexed like the starting matrix, from the SW corner, null for water) for each species.  Takes the record id, or the same fields as the parameters form (for ParametersFormPageThree before the record is stored).  Grids are cached by their parameters, and responses repeating the ETag get 304 Not Modified.
     """
     def get(self):
-        data = db.GqlQuery("SELECT * FROM MeadowRecordObject WHERE id=:1",
-                            self.request.get('id'))
-        self.response.out.write(data[0].to_xml())
+        id = self.request.get('id')
+        if (id):
+            record = get_record(id)
+            if (record is None):
+                self.error(404)
+                return
+            parameters = record.simulation_parameters()
+        else:
+            parameters = form_suitability_parameters(self.request)
+        output_format = self.request.get('format', 'json')
+        species = self.request.get('species')
+        if ((output_format == 'png') and (species not in ('1', '2', '3', '4', '5'))):
+            self.error(400)
+            return
+        try:
+            grid = get_suitability(parameters)
+        except KeyError:
+            #Not a valid webform value
+            self.error(400)
+            return
+        etag = '"%s:%s:%s"' % (suitability_key(parameters), output_format, species)
+        self.response.headers['ETag'] = etag
+        if_none_match = self.request.headers.get('If-None-Match', '')
+        if (etag in [tag.strip() for tag in if_none_match.split(',')]):
+            self.response.set_status(304)
+            return
+        if (output_format == 'png'):
+            self.response.headers['Content-Type'] = 'image/png'
+            self.response.out.write(vMeadowMaps.suitability_png(grid[int(species) - 1]))
+        else:
+            self.response.headers['Content-Type'] = 'application/json'
+            species_grids = {}
+            for i in range(5):
+                species_grids[str(i + 1)] = grid[i]
+            self.response.out.write(json.dumps({'x_size': vMeadowEngine.X_CELLS, 'y_size': vMeadowEngine.Y_CELLS,
+                                                      'species': species_grids}))
 
 
 class PlantPicturesPage(webapp.RequestHandler):
@@ -522,7 +830,7 @@ class ParametersFormPageThree(webapp.RequestHandler):
         if (submit_value == 'Submit parameters'):
             page = HtmlPage()
             self.response.out.write(page.header)
-            self.id = str(int(time.time()))
+            self.id = allocate_record_id()
             self.store_record()
             if (self.request.get('disturbance_only') == "0"):
                 self.response.out.write(self.success_output_all_parameters % self.id)
@@ -537,7 +845,7 @@ class ParametersFormPageThree(webapp.RequestHandler):
         disturbance_only = self.request.get('disturbance_only')
         ongoing_disturbance = self.request.get('ongoing_disturbance')
         terrain = self.request.get('terrain')
-        starting_matrix = list(self.request.get('starting_matrix'))
+        starting_matrix = list(vMeadowEngine.decode_matrix(self.request.get('starting_matrix')))
         if (len(starting_matrix) == 0):
             #Set up the default starting matrix with all Rs
             starting_matrix = []
@@ -587,6 +895,13 @@ class ParametersFormPageThree(webapp.RequestHandler):
             if (j != 49):
                 self.response.out.write('<br>')
         self.response.out.write(self.form_table_footer)
+        if (disturbance_only == '0'):
+            #Show where each species can thrive on the selected terrain and soil maps
+            query = urllib.urlencode(form_suitability_parameters(self.request).items())
+            self.response.out.write(self.form_suitability_header)
+            for x in range(1, 6):
+                self.response.out.write(self.form_suitability_image % (x, cgi.escape(self.request.get('plant_code_%s' % x)), x, cgi.escape(query, True), terrain))
+            self.response.out.write(self.form_suitability_footer)
         if (len(selected) > 0):
             if (disturbance_only == "0"):
                 self.response.out.write(self.form_cell_value_selector)
@@ -601,7 +916,7 @@ class ParametersFormPageThree(webapp.RequestHandler):
         #Pass the list of selected cells, the current starting matrix, whether we are only changing disturbance, ongoing disturbance value and which terrain we are using.
         self.response.out.write(self.form_active_hidden_fields % (
             ','.join(selected),
-            ''.join(starting_matrix),
+            vMeadowEngine.encode_matrix(''.join(starting_matrix)),
             disturbance_only,
             terrain))
         #Pass the values from previous form pages (if we used those previous pages)
@@ -649,9 +964,9 @@ class ParametersFormPageThree(webapp.RequestHandler):
         return area_list
 
     def store_record(self):
-        # Get a db record instance to hold the form data
-        record = MeadowRecordObject()
-        # Store a timestamp as the record id
+        # Get a db record instance to hold the form data, keyed by id so it can be fetched directly
+        record = MeadowRecordObject(key_name=record_key_name(self.id))
+        # Store the allocated record id
         record.id = self.id
         # Store the disturbance_only, matrix xy sizes, position, spacing, appearance, terrain, salinity, drainage, and fertility maps.
         record.disturbance_only = int(self.request.get('disturbance_only'))
@@ -711,16 +1026,17 @@ class ParametersFormPageThree(webapp.RequestHandler):
         record.ongoing_disturbance = self.request.get('ongoing_disturbance')
         # Store the community matrix
         #This matrix starts with 0 in the NW corner and I need 0 in the SW corner
-        temp_starting_matrix = self.request.get('starting_matrix')
+        temp_starting_matrix = vMeadowEngine.decode_matrix(self.request.get('starting_matrix'))
         upside_down_matrix = []
         for y in range(50):
             row = ''
             for x in range(50):
                 row += temp_starting_matrix[y * 50 + x]
             upside_down_matrix.append(row)
-        record.starting_matrix = ''
+        starting_matrix = ''
         for y in range(50):
-            record.starting_matrix += upside_down_matrix[49 - y]
+            starting_matrix += upside_down_matrix[49 - y]
+        record.encoded_starting_matrix = vMeadowEngine.encode_matrix(starting_matrix)
         record.put()
 
     success_output_all_parameters = """
@@ -791,6 +1107,17 @@ class ParametersFormPageThree(webapp.RequestHandler):
 
     form_table_footer = '</td></tbody></table>'
 
+    form_suitability_header = """
+        <b>Where each species can thrive on this terrain and soil (green is most suitable, red least):</b><br>
+        <table><tbody><tr>
+        """
+
+    form_suitability_image = '<td align="center">Species %s (%s)<br><img src="/suitability?format=png&amp;species=%s&amp;%s" width="125" height="125" style="background-image: url(/images/Terrain%s_map.jpg); background-size: 125px 125px;"></td>'
+
+    form_suitability_footer = """
+        </tr></tbody></table>
+        """
+
     form_cell_value_selector_disturbance_only = """
         <b>Cell value:</b>
         <select name="cell_value">
@@ -901,6 +1228,8 @@ application = webapp.WSGIApplication([
     ('/parametersform2', ParametersFormPageTwo),
     ('/parametersform3', ParametersFormPageThree),
     ('/data', GetParameters),
+    ('/preview', PreviewSimulation),
+    ('/suitability', SuitabilityMap),
     ('/selectmap', SelectTerrainMapPage),
     ('/plants', PlantPicturesPage),
     ('/log', RedirectToLog)], debug=True)
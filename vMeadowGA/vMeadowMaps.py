@@ -0,0 +1,313 @@
+"""
+ * Copyright (c) Contributors http://github.com/aduffy70/vMeadowGA
+ * See CONTRIBUTORS.TXT for a full list of copyright holders.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions are met:
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in the
+ *       documentation and/or other materials provided with the distribution.
+ *     * Neither the name of the vMeadowGA module nor the
+ *       names of its contributors may be used to endorse or promote products
+ *       derived from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE DEVELOPERS ``AS IS'' AND ANY
+ * EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+ * WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+ * DISCLAIMED. IN NO EVENT SHALL THE CONTRIBUTORS BE LIABLE FOR ANY
+ * DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+ * (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+ * LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ * ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+ * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Decoded environmental maps (terrain heightmaps and soil maps) for the simulation engine.  The maps are decoded from the images once, by running this module as a script (python vMeadowMaps.py), and stored in MAP_DATA_FILE with one byte per cell of the community matrix.  The app only ever reads that file, once per instance.
+
+import array
+import os
+import struct
+import zlib
+try:
+    from PIL import Image
+except ImportError:
+    #Only needed to rebuild the map data from the JPEG soil maps
+    Image = None
+import vMeadowEngine
+
+# Directory of this module, which the map data file and image paths are relative to
+MAP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# File holding the decoded maps
+MAP_DATA_FILE = os.path.join(MAP_DIRECTORY, 'maps.dat')
+MAP_DATA_MAGIC = 'VMAP1'
+
+# First bytes of every PNG image
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# Heightmap images for each terrain choice (the files the region module loads) and soil map images for each soil map choice (0=SoilX, 1=SoilY, 2=SoilZ)
+TERRAIN_IMAGES = [os.path.join(MAP_DIRECTORY, '..', 'vMeadow', 'terrain', 'Terrain%d.png' % terrain) for terrain in range(4)]
+SOIL_IMAGES = [os.path.join(MAP_DIRECTORY, 'images', 'Soil%smap.jpg' % axis) for axis in ('X', 'Y', 'Z')]
+
+# Height in meters of a white heightmap pixel, as opensim loads png terrains
+HEIGHTMAP_SCALE = 128.0
+# Size in meters of the region the maps cover
+REGION_SIZE = 256
+# Stored altitudes are in half meters and stored soil values in 255ths
+ALTITUDE_SCALE = 2.0
+SOIL_SCALE = 255.0
+
+# Opacity of suitability overlay cells (0-255)
+SUITABILITY_ALPHA = 160
+
+# Region coordinates of the southwest cell of the community matrix and the distance between cells (locked in the webform)
+X_LOCATION = 5
+Y_LOCATION = 5
+SPACING = 5
+
+
+def decode_png(data):
+    """
+    Returns the width, height, channels and rows (top row first, each a list of channel bytes) of an 8-bit, non-interlaced, non-palette PNG image.
+    """
+    if (data[:8] != PNG_SIGNATURE):
+        raise ValueError('Not a PNG image')
+    position = 8
+    compressed = []
+    while (position < len(data)):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        if (chunk_type == 'IHDR'):
+            width, height, bit_depth, color_type, compression, filter_method, interlace = struct.unpack('>IIBBBBB', chunk)
+            channels = {0: 1, 2: 3, 4: 2, 6: 4}.get(color_type)
+            if ((bit_depth != 8) or (channels is None) or interlace):
+                raise ValueError('Unsupported PNG format')
+        elif (chunk_type == 'IDAT'):
+            compressed.append(chunk)
+        elif (chunk_type == 'IEND'):
+            break
+        position += length + 12
+    raw = array.array('B', zlib.decompress(''.join(compressed)))
+    stride = width * channels
+    rows = []
+    previous = [0] * stride
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type = raw[start]
+        row = raw[start + 1:start + 1 + stride].tolist()
+        for i in range(stride):
+            if (i >= channels):
+                left = row[i - channels]
+                upper_left = previous[i - channels]
+            else:
+                left = 0
+                upper_left = 0
+            up = previous[i]
+            if (filter_type == 1):
+                row[i] = (row[i] + left) & 0xff
+            elif (filter_type == 2):
+                row[i] = (row[i] + up) & 0xff
+            elif (filter_type == 3):
+                row[i] = (row[i] + ((left + up) >> 1)) & 0xff
+            elif (filter_type == 4):
+                #Paeth predictor
+                estimate = left + up - upper_left
+                left_distance = abs(estimate - left)
+                up_distance = abs(estimate - up)
+                upper_left_distance = abs(estimate - upper_left)
+                if ((left_distance <= up_distance) and (left_distance <= upper_left_distance)):
+                    predictor = left
+                elif (up_distance <= upper_left_distance):
+                    predictor = up
+                else:
+                    predictor = upper_left
+                row[i] = (row[i] + predictor) & 0xff
+        rows.append(row)
+        previous = row
+    return width, height, channels, rows
+
+
+def png_chunk(chunk_type, data):
+    """
+    Returns a PNG chunk with its length and CRC.
+    """
+    chunk = chunk_type + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+def encode_png(width, height, rows):
+    """
+    Returns an 8-bit RGBA PNG image of rows (top row first, each a list of width * 4 channel bytes), without filtering.
+    """
+    raw = []
+    for row in rows:
+        raw.append(struct.pack('>B%dB' % len(row), 0, *row))
+    return ''.join([PNG_SIGNATURE,
+                    png_chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+                    png_chunk('IDAT', zlib.compress(''.join(raw), 9)),
+                    png_chunk('IEND', '')])
+
+
+def read_brightness(path):
+    """
+    Returns the width, height and rows (top row first) of pixel brightnesses (0-255, the average of the largest and smallest color channels, like System.Drawing's GetBrightness) of an image.  PNG images are decoded directly.  Other formats need PIL.
+    """
+    image_file = open(path, 'rb')
+    try:
+        data = image_file.read()
+    finally:
+        image_file.close()
+    if (path.lower().endswith('.png')):
+        width, height, channels, rows = decode_png(data)
+        color_channels = min(channels, 3)
+        pixels = []
+        for row in rows:
+            pixels.append([row[x * channels:x * channels + color_channels] for x in range(width)])
+    else:
+        if (Image is None):
+            raise ValueError('PIL is needed to decode %s' % path)
+        image = Image.open(path).convert('RGB')
+        width, height = image.size
+        pixels = [[image.getpixel((x, y)) for x in range(width)] for y in range(height)]
+    brightness = [[(max(pixel) + min(pixel)) / 2.0 for pixel in row] for row in pixels]
+    return width, height, brightness
+
+
+def cell_values(path, scale):
+    """
+    Returns the brightness of an image at the region position of each cell (indexed y * X_CELLS + x from the southwest corner), scaled and rounded to a byte.  The top row of the image is the north edge of the region.
+    """
+    width, height, brightness = read_brightness(path)
+    values = []
+    for y in range(vMeadowEngine.Y_CELLS):
+        for x in range(vMeadowEngine.X_CELLS):
+            image_x = (X_LOCATION + x * SPACING) * width // REGION_SIZE
+            image_y = height - 1 - (Y_LOCATION + y * SPACING) * height // REGION_SIZE
+            values.append(min(255, int(round(brightness[image_y][image_x] * scale))))
+    return values
+
+
+def build_map_data(path=MAP_DATA_FILE):
+    """
+    Decodes the terrain and soil map images and writes them to the map data file.
+    """
+    maps = []
+    for terrain, image in enumerate(TERRAIN_IMAGES):
+        maps.append(('terrain%d' % terrain, cell_values(image, HEIGHTMAP_SCALE / 255.0 * ALTITUDE_SCALE)))
+    for soil_map, image in enumerate(SOIL_IMAGES):
+        maps.append(('soil%d' % soil_map, cell_values(image, 1.0)))
+    data = [MAP_DATA_MAGIC, struct.pack('>H', len(maps))]
+    for name, values in maps:
+        data.append(struct.pack('>B', len(name)) + name)
+        data.append(struct.pack('>%dB' % len(values), *values))
+    map_file = open(path, 'wb')
+    try:
+        map_file.write(''.join(data))
+    finally:
+        map_file.close()
+
+
+def load_map_data(path=MAP_DATA_FILE):
+    """
+    Returns the maps in the map data file by name, each a list of one byte per cell.  Returns no maps if the file is missing.  Reads the file as bytes, so it also works under Python 3 for vMeadowSweep.
+    """
+    if (not os.path.exists(path)):
+        return {}
+    map_file = open(path, 'rb')
+    try:
+        data = map_file.read()
+    finally:
+        map_file.close()
+    if (data[:len(MAP_DATA_MAGIC)] != MAP_DATA_MAGIC.encode('ascii')):
+        raise ValueError('%s is not a map data file' % path)
+    position = len(MAP_DATA_MAGIC)
+    count = struct.unpack('>H', data[position:position + 2])[0]
+    position += 2
+    maps = {}
+    for i in range(count):
+        name_length = struct.unpack('>B', data[position:position + 1])[0]
+        name = data[position + 1:position + 1 + name_length].decode('ascii')
+        position += 1 + name_length
+        maps[name] = array.array('B', data[position:position + vMeadowEngine.CELLS]).tolist()
+        position += vMeadowEngine.CELLS
+    return maps
+
+
+# Decoded maps, read once per instance
+map_data = load_map_data()
+
+# Environments built from the maps, by (terrain, salinity, drainage, fertility) choice
+environment_cache = {}
+
+
+def altitudes(terrain):
+    """
+    Returns the altitude in meters of each cell for a terrain choice, or None if the terrain isn't available.
+    """
+    values = map_data.get('terrain%s' % terrain)
+    if (values is None):
+        return None
+    return [value / ALTITUDE_SCALE for value in values]
+
+
+def soil_values(soil_map):
+    """
+    Returns the soil value (0-1.0) of each cell for a soil map choice, or None if the map isn't available.
+    """
+    values = map_data.get('soil%s' % soil_map)
+    if (values is None):
+        return None
+    return [value / SOIL_SCALE for value in values]
+
+
+def record_environment(parameters):
+    """
+    Returns the MeadowEnvironment for a record's terrain and soil map choices.  Maps that aren't available (e.g. for disturbance only records) keep the engine defaults.
+    """
+    key = (parameters.get('terrain'), parameters.get('salinity'), parameters.get('drainage'), parameters.get('fertility'))
+    if (key not in environment_cache):
+        terrain, salinity, drainage, fertility = key
+        environment_cache[key] = vMeadowEngine.MeadowEnvironment(altitudes(terrain), soil_values(salinity),
+                                                                 soil_values(drainage), soil_values(fertility))
+    return environment_cache[key]
+
+
+def suitability(parameters):
+    """
+    Returns the environmental health (0-1.0, the same modifier the region applies to survival) of each species (rows 0-4 for species 1-5) in each cell for a record's parameters, calculated for the whole grid at once with numpy (see vMeadowEngine.MeadowEnvironment.health).  Water cells, where no species can grow, are None.
+    """
+    environment = record_environment(parameters)
+    health = environment.health(vMeadowEngine.MeadowCommunity(parameters))
+    grid = []
+    for species in range(1, 6):
+        values = []
+        for cell in range(vMeadowEngine.CELLS):
+            if (environment.is_land(cell)):
+                values.append(round(health[species][cell], 3))
+            else:
+                values.append(None)
+        grid.append(values)
+    return grid
+
+
+def suitability_png(values):
+    """
+    Returns a PNG overlay of one species' suitability, shading each cell from red (unsuitable) through yellow to green (most suitable).  Water cells are transparent.  The top row of the image is the north edge of the matrix.
+    """
+    rows = []
+    for y in range(vMeadowEngine.Y_CELLS - 1, -1, -1):
+        row = []
+        for x in range(vMeadowEngine.X_CELLS):
+            value = values[y * vMeadowEngine.X_CELLS + x]
+            if (value is None):
+                row.extend([0, 0, 0, 0])
+            else:
+                row.extend([int(min(1.0, 2.0 - 2.0 * value) * 255), int(min(1.0, 2.0 * value) * 255), 0, SUITABILITY_ALPHA])
+        rows.append(row)
+    return encode_png(vMeadowEngine.X_CELLS, vMeadowEngine.Y_CELLS, rows)
+
+
+if __name__ == '__main__':
+    build_map_data()
@@ -0,0 +1,169 @@
+"""
+ * Copyright (c) Contributors http://github.com/aduffy70/vMeadowGA
+ * See CONTRIBUTORS.TXT for a full list of copyright holders.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions are met:
+ *     * Redistributions of source code must retain the above copyright
+ *       notice, this list of conditions and the following disclaimer.
+ *     * Redistributions in binary form must reproduce the above copyright
+ *       notice, this list of conditions and the following disclaimer in the
+ *       documentation and/or other materials provided with the distribution.
+ *     * Neither the name of the vMeadowGA module nor the
+ *       names of its contributors may be used to endorse or promote products
+ *       derived from this software without specific prior written permission.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE DEVELOPERS ``AS IS'' AND ANY
+ * EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+ * WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+ * DISCLAIMED. IN NO EVENT SHALL THE CONTRIBUTORS BE LIABLE FOR ANY
+ * DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+ * (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+ * LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ * ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+ * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+ * SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+# Runs the vMeadow simulation engine over a grid of parameter variations of a community record, across a pool of processes.  Run from a workstation (it is not part of the App Engine app), e.g.:
+#
+#   python vMeadowSweep.py http://vmeadowga.appspot.com/data?id=1234 --vary "replacement_3=L,L,L,L,L,L|H,H,H,H,H,H" --vary "ongoing_disturbance=N|L|M|H" --replicates 5 --generations 500
+#
+# Each run is given a region tag (the sweep's --prefix followed by 001, 002, ...), listed with its parameters on stderr.  The default prefix includes the start time so a sweep doesn't overwrite the logs of earlier sweeps of the same record.  As runs finish, their steps are written to stdout as "region_tag,step,gaps,species1,...,species5" lines and, with --addlogs, posted to a vpcsimlog /addlogs url under the base record's id.  Steps the log rejects are reported on stderr, and the sweep then exits with status 1.
+
+import itertools
+import multiprocessing
+import optparse
+import sys
+import time
+import xml.etree.ElementTree
+try:
+    from urllib.request import urlopen
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib2 import urlopen
+    from urllib import urlencode
+import vMeadowEngine
+import vMeadowMaps
+
+
+def read_record(source):
+    """
+    Returns the properties of a community record from a /data url or a file holding its XML, in either the plain or the compact format.  A compact record's encoded_starting_matrix is decoded into starting_matrix, which is what the engine reads.
+    """
+    if (source.startswith('http://') or source.startswith('https://')):
+        xml_file = urlopen(source)
+    else:
+        xml_file = open(source, 'rb')
+    try:
+        entity = xml.etree.ElementTree.parse(xml_file).getroot()
+    finally:
+        xml_file.close()
+    parameters = {}
+    for property in entity.findall('property'):
+        parameters[property.get('name')] = (property.text or '').strip()
+    if (parameters.get('encoded_starting_matrix')):
+        parameters['starting_matrix'] = vMeadowEngine.decode_runs(parameters['encoded_starting_matrix'])
+    return parameters
+
+
+def parse_variations(variations):
+    """
+    Returns (name, values) pairs from "name=value1|value2|..." strings.
+    """
+    parsed = []
+    for variation in variations:
+        name, values = variation.split('=', 1)
+        parsed.append((name.strip(), values.split('|')))
+    return parsed
+
+
+def sweep_runs(parameters, variations, replicates, generations, prefix):
+    """
+    Returns a (region_tag, description, parameters, seed, generations) run for every combination of variation values and replicate seed.
+    """
+    runs = []
+    names = [name for name, values in variations]
+    value_lists = [values for name, values in variations]
+    for values in itertools.product(*value_lists):
+        run_parameters = dict(parameters)
+        run_parameters.update(dict(zip(names, values)))
+        for seed in range(replicates):
+            region_tag = '%s%03d' % (prefix, len(runs) + 1)
+            description = ' '.join(['%s=%s' % pair for pair in zip(names, values)] + ['seed=%d' % seed])
+            runs.append((region_tag, description, run_parameters, seed, generations))
+    return runs
+
+
+def run_simulation(run):
+    """
+    Runs one simulation in a pool process.  Returns its region tag and log rows.
+    """
+    region_tag, description, parameters, seed, generations = run
+    simulation = vMeadowEngine.MeadowSimulation(parameters, seed, vMeadowMaps.record_environment(parameters))
+    simulation.run(generations)
+    return region_tag, simulation.log_rows()
+
+
+def post_log(url, body, region_tag, step_count):
+    """
+    Posts a run's steps to a vpcsimlog /addlogs url.  Returns the number of steps it didn't store (all of them if the request fails), reporting them on stderr.
+    """
+    try:
+        response = urlopen(url, body.encode('ascii'))
+        try:
+            statuses = response.read().decode('ascii').split()
+        finally:
+            response.close()
+    except IOError:
+        sys.stderr.write('%s: posting to %s failed: %s\n' % (region_tag, url, sys.exc_info()[1]))
+        return step_count
+    failed = len([status for status in statuses if (status != 'SUCCESS')]) + max(0, step_count - len(statuses))
+    if (failed):
+        sys.stderr.write('%s: %d of %d steps FAILED\n' % (region_tag, failed, step_count))
+    return failed
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog RECORD_URL_OR_FILE [options]')
+    parser.add_option('--vary', action='append', default=[],
+                      help='parameter variation as name=value1|value2|... (repeatable)')
+    parser.add_option('--replicates', type='int', default=1,
+                      help='number of seeds run for each combination of values')
+    parser.add_option('--generations', type='int', default=500,
+                      help='generations in each run, including the starting generation')
+    parser.add_option('--processes', type='int', default=None,
+                      help='number of worker processes (default one per core)')
+    parser.add_option('--addlogs', default=None,
+                      help='vpcsimlog /addlogs url to post each finished run to')
+    parser.add_option('--prefix', default='sweep%d-' % int(time.time()),
+                      help='start of the region tag of each run (default sweep<start time>-)')
+    options, arguments = parser.parse_args()
+    if (len(arguments) != 1):
+        parser.error('expected one record url or file')
+    parameters = read_record(arguments[0])
+    runs = sweep_runs(parameters, parse_variations(options.vary), options.replicates, options.generations, options.prefix)
+    for region_tag, description, run_parameters, seed, generations in runs:
+        sys.stderr.write('%s %s\n' % (region_tag, description))
+    failed = 0
+    pool = multiprocessing.Pool(options.processes)
+    try:
+        #Runs take about the same time, so hand them out one at a time and write each as soon as it finishes
+        for region_tag, rows in pool.imap_unordered(run_simulation, runs, 1):
+            sys.stdout.write(''.join(['%s,%s\n' % (region_tag, row) for row in rows]))
+            sys.stdout.flush()
+            if (options.addlogs):
+                body = urlencode({'sim_id': parameters.get('id', ''),
+                                  'region_tag': region_tag,
+                                  'data': '\n'.join(rows)})
+                failed += post_log(options.addlogs, body, region_tag, len(rows))
+    finally:
+        pool.close()
+        pool.join()
+    if (failed):
+        sys.stderr.write('%d steps were not logged\n' % failed)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
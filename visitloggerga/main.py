@@ -3,7 +3,90 @@ from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 from google.appengine.ext import db
 from google.appengine.api import users
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from google.appengine.ext.webapp import template
+from django.utils import simplejson
+import array
+import csv
+import calendar
+import datetime
+import gzip
+import hashlib
+import math
+import random
+import time
+import urllib
+import zlib
+
+# Number of visit records shown per page of the main page, by default and at most
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Seconds a rendered main page stays in memcache (pages are also replaced
+# whenever the account's log changes)
+PAGE_CACHE_SECONDS = 3600
+
+# Number of shard entities each visit counter is split across
+VISIT_COUNTER_SHARDS = 10
+# Number of days shown on the dashboard, by default and at most
+DEFAULT_DASHBOARD_DAYS = 30
+MAX_DASHBOARD_DAYS = 366
+
+# Unique visitor sketches use 2**VISITOR_SKETCH_PRECISION one byte registers
+# (about 3% standard error at 10)
+VISITOR_SKETCH_PRECISION = 10
+VISITOR_SKETCH_REGISTERS = 1 << VISITOR_SKETCH_PRECISION
+
+# Visit records older than this many whole days are compacted into daily archives
+VISIT_ARCHIVE_DAYS = 30
+# Number of archives read per datastore round trip
+ARCHIVE_BATCH_SIZE = 50
+# Main page cursors that continue into the archives start with this prefix
+ARCHIVE_CURSOR_PREFIX = 'archive:'
+
+# Longest name prefix indexed for avatar name search (longer searches are cut to this)
+MAX_NAME_PREFIX_LENGTH = 24
+# Longest name prefix indexed on the daily archives (searches match the longer
+# prefix against the archived visits themselves)
+ARCHIVE_NAME_PREFIX_LENGTH = 3
+# Number of visit records (or archives) updated per round when indexing the names of older records
+MIGRATE_BATCH_SIZE = 100
+
+# Number of visits returned by one export request, by default and at most
+DEFAULT_EXPORT_LIMIT = 5000
+MAX_EXPORT_LIMIT = 20000
+# Number of visit records fetched per datastore round trip when exporting
+EXPORT_BATCH_SIZE = 200
+# Export cursors that continue in the visit records (after the archives) start with this prefix
+RECORD_CURSOR_PREFIX = 'records:'
+EXPORT_COLUMNS = ['region', 'name', 'local_datetime', 'global_datetime']
+
+# Maximum number of entities the datastore accepts in a single batch put
+MAX_BATCH_PUT = 500
+
+# Number of keys deleted per datastore round trip, and number of rounds per clear log task
+DELETE_BATCH_SIZE = 500
+DELETE_BATCHES_PER_TASK = 20
+
+# How visits from regions are stored: 'sync' stores them before responding,
+# 'buffered' adds them to the memcache write-behind buffer and responds
+# immediately (buffered visits are lost if memcache evicts them before they
+# are flushed)
+VISIT_WRITE_MODE = 'sync'
+# Number of buffered visits that triggers a flush between the regular cron flushes
+VISIT_BUFFER_FLUSH_THRESHOLD = 100
+# Number of buffered visits read from memcache and stored per round when flushing
+BUFFER_FLUSH_BATCH_SIZE = 200
+# Missing slots this close to the end of the buffer may still be being written
+BUFFER_IN_FLIGHT_SLOTS = 20
+# Seconds a recent slot can be missing before a flush skips it
+BUFFER_MISSING_SLOT_SECONDS = 60
+# Seconds before the lock held by a flush expires if the flush dies
+BUFFER_LOCK_SECONDS = 300
+# Bits of a buffer slot number that count slots within a generation (the bits
+# above hold the generation)
+BUFFER_GENERATION_SHIFT = 32
 
 class VisitRecord(db.Model):
     """
@@ -18,26 +101,910 @@ class VisitRecord(db.Model):
     #visit datetime provided by the region (good for humans, bad for sorting)
     local_datetime = db.StringProperty()
     #DateTime recorded by this app (good for sorting, bad for humans - utc)
+    global_datetime = db.DateTimeProperty(auto_now_add=True)
+    #Normalized prefixes of the name and of each word in it, for name search
+    name_prefixes = db.StringListProperty()
+
+
+class ClearLogStatus(db.Model):
+    """
+    Tracks the background deletion of the log records for an account.
+    """
+    #google account whose records are being deleted
+    account = db.StringProperty()
+    #RUNNING while records are being deleted, DONE when finished
+    status = db.StringProperty()
+    #Records logged up to this time are deleted (visits logged afterwards are kept)
+    cutoff = db.DateTimeProperty()
+    #Number of records deleted so far
+    deleted_count = db.IntegerProperty(default=0)
+    #Number of times the log has been cleared.  Visit counters and sketches
+    #are keyed by it, so each clear starts them again from the visits logged
+    #after its cutoff.
+    generation = db.IntegerProperty(default=0)
+    #DateTime the status was last updated
     global_datetime = db.DateTimeProperty(auto_now=True)
 
 
+class VisitCounterShard(db.Model):
+    """
+    One shard of a visit counter.  Each counter is split across
+    VISIT_COUNTER_SHARDS entities so busy regions don't contend on one entity.
+    """
+    #google account the counter belongs to
+    account = db.StringProperty()
+    #'region' for visits per region per day, 'avatar' for visits per avatar
+    counter_type = db.StringProperty()
+    #opensim region counted (region counters)
+    region = db.StringProperty()
+    #utc day counted (region counters)
+    day = db.DateProperty()
+    #name of the avatar counted (avatar counters)
+    name = db.StringProperty()
+    #Number of visits counted by this shard
+    count = db.IntegerProperty(default=0)
+    #Clear generation of the account the shard counts for (see ClearLogStatus)
+    generation = db.IntegerProperty(default=0)
+    #DateTime the shard was last updated
+    updated = db.DateTimeProperty(auto_now=True)
+
+
+class VisitorSketch(db.Model):
+    """
+    HyperLogLog sketch of the avatars visiting a region on one day.  Sketches
+    are sharded like the visit counters and merge exactly, across shards,
+    days and regions.
+    """
+    #google account the sketch belongs to
+    account = db.StringProperty()
+    #opensim region the visitors were seen in
+    region = db.StringProperty()
+    #utc day the visitors were seen
+    day = db.DateProperty()
+    #One byte register per bucket
+    registers = db.BlobProperty()
+    #Clear generation of the account the sketch is for (see ClearLogStatus)
+    generation = db.IntegerProperty(default=0)
+    #DateTime the sketch was last updated
+    updated = db.DateTimeProperty(auto_now=True)
+
+
+class VisitArchive(db.Model):
+    """
+    Compressed visits to one region on one utc day, compacted from the
+    VisitRecords older than VISIT_ARCHIVE_DAYS.
+    """
+    #google account authorized to view the records
+    account = db.StringProperty()
+    #opensim region that created the records
+    region = db.StringProperty()
+    #utc day of the archived visits
+    day = db.DateProperty()
+    #Number of archived visits
+    visit_count = db.IntegerProperty(default=0)
+    #zlib compressed JSON list of [name, local_datetime, global_datetime in
+    #microseconds since the epoch, id of the original VisitRecord]
+    visits = db.BlobProperty()
+    #Name prefixes (up to ARCHIVE_NAME_PREFIX_LENGTH characters) of the
+    #archived visits, for name search
+    name_prefixes = db.StringListProperty()
+    #DateTime the archive was last updated
+    updated = db.DateTimeProperty(auto_now=True)
+
+    def get_visits(self):
+        if not self.visits:
+            return []
+        return simplejson.loads(zlib.decompress(self.visits))
+
+    def set_visits(self, visits):
+        self.visits = zlib.compress(simplejson.dumps(visits), 9)
+        self.visit_count = len(visits)
+        self.name_prefixes = archive_name_prefixes(visits)
+
+    def visit_dicts(self):
+        """
+        Archived visits in the same form as the visit dictionaries stored
+        as VisitRecords.
+        """
+        return [{'account': self.account,
+                 'region': self.region,
+                 'name': name,
+                 'local_datetime': local_datetime,
+                 'global_datetime': microseconds_to_datetime(global_microseconds)}
+                for name, local_datetime, global_microseconds, record_id in self.get_visits()]
+
+
+class WriteBehindBuffer():
+    """
+    Memcache-backed buffer of pending datastore writes.  Payloads are kept in
+    numbered slots and flushed in the order they were appended.  Slot numbers
+    carry the generation of the counter (see generation_start), so a counter
+    that memcache evicted starts again in fresh slots.  The same class is used
+    by the vpcsimlog app, which is deployed separately, so the two copies are
+    kept identical.
+    """
+    def __init__(self, name, flush_url, flush_threshold):
+        self.name = name
+        self.flush_url = flush_url
+        self.flush_threshold = flush_threshold
+
+    def slot_key(self, slot):
+        return '%s:%d' % (self.name, slot)
+
+    def append(self, payload):
+        """
+        Adds a payload, queuing a flush every flush_threshold payloads.
+        Returns False if memcache could not accept it.
+        """
+        slot = memcache.incr(self.name + ':count', initial_value=self.generation_start())
+        if (slot is None) or (not memcache.set(self.slot_key(slot), payload)):
+            return False
+        if (slot % (1 << BUFFER_GENERATION_SHIFT)) % self.flush_threshold == 0:
+            taskqueue.add(url=self.flush_url)
+        return True
+
+    def flush(self, store):
+        """
+        Passes buffered payloads to store in batches and removes them from the
+        buffer.  Only one flush runs at a time.
+        """
+        if not memcache.add(self.name + ':lock', 1, time=BUFFER_LOCK_SECONDS):
+            return 0
+        stored = 0
+        try:
+            last_slot = memcache.get(self.name + ':count') or 0
+            flushed_slot = memcache.get(self.name + ':flushed') or 0
+            generation = last_slot >> BUFFER_GENERATION_SHIFT
+            if (flushed_slot >> BUFFER_GENERATION_SHIFT) != generation:
+                #The counter was evicted and a new generation has started.
+                #Slots left in the old one are abandoned.
+                flushed_slot = generation << BUFFER_GENERATION_SHIFT
+            while flushed_slot < last_slot:
+                slots = range(flushed_slot + 1, min(last_slot, flushed_slot + BUFFER_FLUSH_BATCH_SIZE) + 1)
+                keys = [self.slot_key(slot) for slot in slots]
+                buffered = memcache.get_multi(keys)
+                payloads = []
+                for slot, key in zip(slots, keys):
+                    if key in buffered:
+                        payloads.append(buffered[key])
+                    elif (slot > last_slot - BUFFER_IN_FLIGHT_SLOTS and
+                          not self.missing_slot_expired(slot)):
+                        #A recent slot may still be being written
+                        break
+                    flushed_slot = slot
+                if payloads:
+                    store(payloads)
+                    stored += len(payloads)
+                memcache.delete_multi([self.slot_key(slot) for slot in slots if slot <= flushed_slot])
+                memcache.set(self.name + ':flushed', flushed_slot)
+                if flushed_slot < slots[-1]:
+                    break
+        finally:
+            memcache.delete(self.name + ':lock')
+        return stored
+
+    def generation_start(self):
+        """
+        The value a counter started now counts up from.  Its generation is the
+        time in seconds wrapped to 24 bits, so two generations only share a
+        number if they start a multiple of about 194 days apart.
+        """
+        return (int(time.time()) % (1 << 24)) << BUFFER_GENERATION_SHIFT
+
+    def missing_slot_expired(self, slot):
+        """
+        True once a slot has been missing for BUFFER_MISSING_SLOT_SECONDS, so a
+        slot whose payload memcache never accepted doesn't hold up the buffer.
+        Only the first missing slot a flush stops at is timed.
+        """
+        missing = memcache.get(self.name + ':missing')
+        now = time.time()
+        if missing is None or missing[0] != slot:
+            memcache.set(self.name + ':missing', (slot, now))
+            return False
+        return now - missing[1] >= BUFFER_MISSING_SLOT_SECONDS
+
+
+def increment_counter(counter_name, properties, amount):
+    """
+    Adds amount to a randomly chosen shard of a visit counter.
+    """
+    key_name = '%s:%d' % (counter_name, random.randint(0, VISIT_COUNTER_SHARDS - 1))
+    def txn():
+        shard = VisitCounterShard.get_by_key_name(key_name)
+        if shard is None:
+            shard = VisitCounterShard(key_name=key_name, **properties)
+        shard.count += amount
+        shard.put()
+    db.run_in_transaction(txn)
+
+
+def count_visits(visits, generations):
+    """
+    Updates the per region per day and per avatar counters for a list of
+    visit dictionaries, with one increment per counter.  generations holds
+    the clear generation of each account (see clear_generations).
+    """
+    counters = {}
+    for visit in visits:
+        day = visit['global_datetime'].date()
+        generation = generations[visit['account']]
+        region_counter = ('region:%d:%s:%s:%s' % (generation, visit['account'], visit['region'],
+                                                  day.isoformat()),
+                          {'account': visit['account'], 'counter_type': 'region',
+                           'region': visit['region'], 'day': day, 'generation': generation})
+        avatar_counter = ('avatar:%d:%s:%s' % (generation, visit['account'], visit['name']),
+                          {'account': visit['account'], 'counter_type': 'avatar',
+                           'name': visit['name'], 'generation': generation})
+        for counter_name, properties in (region_counter, avatar_counter):
+            if counter_name in counters:
+                counters[counter_name][1] += 1
+            else:
+                counters[counter_name] = [properties, 1]
+    for counter_name, (properties, amount) in counters.items():
+        increment_counter(counter_name, properties, amount)
+
+
+def new_sketch():
+    """
+    Empty visitor sketch registers.
+    """
+    return array.array('B', [0] * VISITOR_SKETCH_REGISTERS)
+
+
+def add_to_sketch(registers, name):
+    """
+    Adds an avatar name to sketch registers.
+    """
+    hash_bits = 64 - VISITOR_SKETCH_PRECISION
+    hash_value = int(hashlib.md5(name.encode('utf-8')).hexdigest()[:16], 16)
+    index = hash_value >> hash_bits
+    rank = 1
+    bit = 1 << (hash_bits - 1)
+    while (rank <= hash_bits) and (not hash_value & bit):
+        rank += 1
+        bit >>= 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def merge_sketches(registers, other_registers):
+    """
+    Merges other_registers into registers.
+    """
+    for i in range(VISITOR_SKETCH_REGISTERS):
+        if other_registers[i] > registers[i]:
+            registers[i] = other_registers[i]
+
+
+def estimate_sketch(registers):
+    """
+    Estimated number of distinct names added to sketch registers.
+    """
+    m = float(VISITOR_SKETCH_REGISTERS)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum([2.0 ** -register for register in registers])
+    zeros = registers.count(0)
+    if (estimate <= 2.5 * m) and zeros:
+        #Linear counting is more accurate for small counts
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def sketch_visits(visits, generations):
+    """
+    Adds the avatars in a list of visit dictionaries to the unique visitor
+    sketches, with one update per sketch.  generations holds the clear
+    generation of each account (see clear_generations).
+    """
+    sketches = {}
+    for visit in visits:
+        day = visit['global_datetime'].date()
+        generation = generations[visit['account']]
+        sketch_name = 'sketch:%d:%s:%s:%s' % (generation, visit['account'], visit['region'],
+                                              day.isoformat())
+        if sketch_name not in sketches:
+            sketches[sketch_name] = ({'account': visit['account'], 'region': visit['region'],
+                                      'day': day, 'generation': generation}, new_sketch())
+        add_to_sketch(sketches[sketch_name][1], visit['name'])
+    for sketch_name, (properties, registers) in sketches.items():
+        key_name = '%s:%d' % (sketch_name, random.randint(0, VISIT_COUNTER_SHARDS - 1))
+        def txn():
+            sketch = VisitorSketch.get_by_key_name(key_name)
+            if sketch is None:
+                sketch = VisitorSketch(key_name=key_name, **properties)
+                sketch.registers = new_sketch().tostring()
+            stored_registers = array.array('B', sketch.registers)
+            merged_registers = array.array('B', stored_registers)
+            merge_sketches(merged_registers, registers)
+            if (not sketch.is_saved()) or (merged_registers != stored_registers):
+                sketch.registers = merged_registers.tostring()
+                sketch.put()
+        db.run_in_transaction(txn)
+
+
+def datetime_to_microseconds(value):
+    return calendar.timegm(value.utctimetuple()) * 1000000 + value.microsecond
+
+
+def microseconds_to_datetime(value):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(microseconds=value)
+
+
+def archive_key_name(account, region, day):
+    """
+    Key name of the VisitArchive for an account, region and day.
+    """
+    return 'archive:%s:%s:%s' % (account, region, day.isoformat())
+
+
+def archive_visit_records(visit_records):
+    """
+    Adds VisitRecords to the daily archives, skipping records an interrupted
+    earlier compaction already archived.  Returns the accounts changed.
+    """
+    groups = {}
+    for visit_record in visit_records:
+        day = visit_record.global_datetime.date()
+        groups.setdefault((visit_record.account, visit_record.region, day), []).append(
+            [visit_record.name, visit_record.local_datetime,
+             datetime_to_microseconds(visit_record.global_datetime),
+             visit_record.key().id_or_name()])
+    for (account, region, day), new_visits in groups.items():
+        key_name = archive_key_name(account, region, day)
+        def txn():
+            archive = VisitArchive.get_by_key_name(key_name)
+            if archive is None:
+                archive = VisitArchive(key_name=key_name, account=account,
+                                       region=region, day=day)
+            visits = archive.get_visits()
+            archived_ids = set([visit[3] for visit in visits])
+            visits.extend([visit for visit in new_visits if visit[3] not in archived_ids])
+            archive.set_visits(visits)
+            archive.put()
+        db.run_in_transaction(txn)
+    return set([account for account, region, day in groups.keys()])
+
+
+def archive_name_prefixes(visits):
+    """
+    Name prefixes up to ARCHIVE_NAME_PREFIX_LENGTH characters of a list of
+    archived visits.
+    """
+    prefixes = set()
+    for visit in visits:
+        prefixes.update([prefix for prefix in name_prefixes(visit[0] or '')
+                         if len(prefix) <= ARCHIVE_NAME_PREFIX_LENGTH])
+    return sorted(prefixes)
+
+
+def iter_archived_visits(account, first_day=None, last_day=None, region=None, newest_first=True,
+                         name_prefix=None):
+    """
+    Yields (day, index, visit) for an account's archived visits, newest first
+    (or oldest first), from the visits on first_day through those on
+    last_day, optionally only for one region or only for avatar names (or a
+    word in them) starting with a normalized name_prefix.  index is the
+    position of the visit within its day.
+    """
+    archives = VisitArchive.all().filter('account =', account)
+    if region is not None:
+        archives.filter('region =', region)
+    if name_prefix:
+        archives.filter('name_prefixes =', name_prefix[:ARCHIVE_NAME_PREFIX_LENGTH])
+    if newest_first:
+        if first_day is not None:
+            archives.filter('day <=', first_day)
+        if last_day is not None:
+            archives.filter('day >=', last_day)
+        archives.order('-day')
+    else:
+        if first_day is not None:
+            archives.filter('day >=', first_day)
+        if last_day is not None:
+            archives.filter('day <=', last_day)
+        archives.order('day')
+    day = None
+    day_visits = []
+    for archive in archives.run(batch_size=ARCHIVE_BATCH_SIZE):
+        if archive.day != day:
+            day_visits.sort(key=lambda visit: visit['global_datetime'], reverse=newest_first)
+            for index, visit in enumerate(day_visits):
+                yield day, index, visit
+            day = archive.day
+            day_visits = []
+        if name_prefix:
+            day_visits.extend([visit for visit in archive.visit_dicts()
+                               if name_prefix in name_prefixes(visit['name'] or '')])
+        else:
+            day_visits.extend(archive.visit_dicts())
+    day_visits.sort(key=lambda visit: visit['global_datetime'], reverse=newest_first)
+    for index, visit in enumerate(day_visits):
+        yield day, index, visit
+
+
+def normalize_name(name):
+    """
+    Lower case name with single spaces between words, as indexed for search.
+    """
+    return ' '.join(name.lower().split())
+
+
+def name_prefixes(name):
+    """
+    Prefixes of the normalized name and of each later word in it, up to
+    MAX_NAME_PREFIX_LENGTH characters, so a search can match the start of
+    either the first or last name.
+    """
+    name = normalize_name(name)
+    words = name.split(' ')
+    prefixes = set()
+    for text in [name] + words[1:]:
+        for length in range(1, min(len(text), MAX_NAME_PREFIX_LENGTH) + 1):
+            prefixes.add(text[:length])
+    return sorted(prefixes)
+
+
+def store_visits(visits):
+    """
+    Stores a list of buffered visit dictionaries with batched puts and adds
+    them to the visit counters and unique visitor sketches.
+    """
+    visit_records = [VisitRecord(name_prefixes=name_prefixes(visit['name']), **visit)
+                     for visit in visits]
+    for i in range(0, len(visit_records), MAX_BATCH_PUT):
+        db.put(visit_records[i:i + MAX_BATCH_PUT])
+    accounts = list(set([visit['account'] for visit in visits]))
+    for account in accounts:
+        invalidate_visit_log(account)
+    generations = clear_generations(accounts)
+    count_visits(visits, generations)
+    sketch_visits(visits, generations)
+
+
+def store_buffered_visits(visits):
+    """
+    Stores visits flushed from the write-behind buffer, dropping those logged
+    at or before the cutoff of a clear of their account's log (the clear may
+    already have finished).
+    """
+    accounts = list(set([visit['account'] for visit in visits]))
+    statuses = ClearLogStatus.get_by_key_name([clear_log_key_name(account) for account in accounts])
+    cutoffs = {}
+    for account, clear_log_status in zip(accounts, statuses):
+        if clear_log_status is not None:
+            cutoffs[account] = clear_log_status.cutoff
+    visits = [visit for visit in visits
+              if (visit['account'] not in cutoffs or
+                  visit['global_datetime'] > cutoffs[visit['account']])]
+    if visits:
+        store_visits(visits)
+
+
+#Write-behind buffer for visits when VISIT_WRITE_MODE is 'buffered'
+visit_buffer = WriteBehindBuffer('visitbuffer', '/tasks/flushvisits', VISIT_BUFFER_FLUSH_THRESHOLD)
+
+
+def clear_log_key_name(account):
+    """
+    Key name of the ClearLogStatus for an account.
+    """
+    return 'clear:%s' % account
+
+
+def clear_generations(accounts):
+    """
+    Dictionary of the clear generation (see ClearLogStatus) of each of a list
+    of accounts.
+    """
+    statuses = ClearLogStatus.get_by_key_name([clear_log_key_name(account) for account in accounts])
+    generations = {}
+    for account, clear_log_status in zip(accounts, statuses):
+        if clear_log_status is None:
+            generations[account] = 0
+        else:
+            generations[account] = clear_log_status.generation
+    return generations
+
+
+def visit_log_version(account):
+    """
+    Version of the account's visit log used to key its cached pages.  A lost
+    version restarts from the current time so it can't reuse an older version.
+    """
+    version_key = 'visitversion:%s' % account
+    version = memcache.get(version_key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not memcache.add(version_key, version):
+            version = memcache.get(version_key) or version
+    return version
+
+
+def invalidate_visit_log(account):
+    """
+    Moves the account's visit log to a new version so cached pages are
+    rendered again.
+    """
+    memcache.incr('visitversion:%s' % account)
+
+
+def get_page_size(request):
+    """
+    Page size requested with the page_size parameter, limited to MAX_PAGE_SIZE.
+    """
+    try:
+        page_size = int(request.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def visit_page_url(page_size, path='/', before=None, after=None, **extra_parameters):
+    """
+    Url for the page of visits logged before (or after) a global_datetime,
+    given in microseconds since the epoch.  The url stays the same size
+    however deep the page is.
+    """
+    parameters = {'page_size': page_size}
+    for name, value in extra_parameters.items():
+        parameters[name] = value.encode('utf-8')
+    if before is not None:
+        parameters['before'] = before
+    if after is not None:
+        parameters['after'] = after
+    return path + '?' + urllib.urlencode(parameters)
+
+
+def get_page_boundary(request, name):
+    """
+    Datetime from a before or after page parameter (microseconds since the
+    epoch), or None if it is missing.  Raises ValueError if it is invalid.
+    """
+    value = request.get(name)
+    if not value:
+        return None
+    return microseconds_to_datetime(int(value))
+
+
+def visit_record_query(account, name_prefix, operator, boundary):
+    """
+    Query for the account's visit records logged before ('<') or after
+    ('>') a boundary datetime (if any), optionally only those matching a
+    name prefix.  Visits before are newest first, visits after oldest first.
+    """
+    conditions = ['account=:1']
+    arguments = [account]
+    if name_prefix:
+        arguments.append(name_prefix)
+        conditions.append('name_prefixes=:%d' % len(arguments))
+    if boundary is not None:
+        arguments.append(boundary)
+        conditions.append('global_datetime%s:%d' % (operator, len(arguments)))
+    if operator == '<':
+        order = 'DESC'
+    else:
+        order = 'ASC'
+    return db.GqlQuery('SELECT * FROM VisitRecord WHERE %s ORDER BY global_datetime %s' %
+                       (' AND '.join(conditions), order), *arguments)
+
+
+def visit_page(account, page_size, before=None, after=None, name_prefix=None):
+    """
+    One page of the account's visits, newest first, as (visits, has_newer,
+    has_older).  The page holds the visits logged before the before
+    datetime, or (with after) the page_size visits logged just after the
+    after datetime, or the newest visits.  With a normalized name_prefix,
+    only visits by avatars whose name (or a word in it) starts with it are
+    included.  Pages continue into the archived visits once the visit
+    records run out, so each page costs the same however long the log grows.
+    """
+    if after is not None:
+        #Oldest first from the boundary: archived visits, then visit records
+        #(one extra visit shows whether there is a newer page)
+        visits = []
+        for day, index, visit in iter_archived_visits(account, after.date(), newest_first=False,
+                                                      name_prefix=name_prefix):
+            if len(visits) > page_size:
+                break
+            if visit['global_datetime'] > after:
+                visits.append(visit)
+        if len(visits) <= page_size:
+            visit_query = visit_record_query(account, name_prefix, '>', after)
+            visits.extend(visit_query.fetch(page_size + 1 - len(visits)))
+        if len(visits) >= page_size:
+            has_newer = len(visits) > page_size
+            visits = visits[:page_size]
+            visits.reverse()
+            return visits, has_newer, True
+        #Less than a page of newer visits is left, so show the first page
+        before = None
+    visit_query = visit_record_query(account, name_prefix, '<', before)
+    #One extra visit shows whether there is an older page
+    visits = visit_query.fetch(page_size + 1)
+    if len(visits) <= page_size:
+        first_day = None
+        if before is not None:
+            first_day = before.date()
+        for day, index, visit in iter_archived_visits(account, first_day, name_prefix=name_prefix):
+            if len(visits) > page_size:
+                break
+            if (before is None) or (visit['global_datetime'] < before):
+                visits.append(visit)
+    return visits[:page_size], before is not None, len(visits) > page_size
+
+
+def visit_datetime(visit):
+    """
+    global_datetime of a VisitRecord or an archived visit dictionary.
+    """
+    if isinstance(visit, dict):
+        return visit['global_datetime']
+    return visit.global_datetime
+
+
+def page_links(template_values, visits, has_newer, has_older, page_size, path='/', **extra_parameters):
+    """
+    Adds the urls of the newer and older pages to template_values, bounded
+    by the first and last visits shown.  Visits logged in the same
+    microsecond as a page boundary may be skipped.
+    """
+    if has_older:
+        template_values['next_url'] = visit_page_url(
+            page_size, path, before=datetime_to_microseconds(visit_datetime(visits[-1])),
+            **extra_parameters)
+    if has_newer:
+        template_values['previous_url'] = visit_page_url(
+            page_size, path, after=datetime_to_microseconds(visit_datetime(visits[0])),
+            **extra_parameters)
+
+
 class MainHandler(webapp.RequestHandler):
     """
-    Main page with log records in reverse chronological order.
+    Main page with log records in reverse chronological order, one page at a
+    time.  Pages are fetched from the global_datetime boundary of the
+    neighbouring page (see visit_page) so each page costs the same however
+    long the log grows.  Rendered pages are cached in memcache until the
+    account's log changes, and repeat requests are answered with 304 Not
+    Modified using the ETag.
     """
     def get(self):
         user = users.get_current_user()
         if not user:
             self.redirect(users.create_login_url(self.request.uri))
         else:
-            visit_records = db.GqlQuery("""SELECT * FROM VisitRecord WHERE
-                                      account=:1 ORDER BY global_datetime
-                                      DESC""", user.email())
-            if (visit_records.count(1) > 0):
-                template_values = {'visit_records': visit_records}
-                self.response.out.write(template.render('mainpage.html', template_values))
+            page_size = get_page_size(self.request)
+            before = self.request.get('before')
+            after = self.request.get('after')
+            version = visit_log_version(user.email())
+            page_key = hashlib.md5((u'%s\n%d\n%d\n%s\n%s' % (user.email(), version, page_size, before,
+                                   after)).encode('utf-8')).hexdigest()
+            etag = '"%s"' % page_key
+            if_none_match = self.request.headers.get('If-None-Match', '')
+            if etag in [tag.strip() for tag in if_none_match.split(',')]:
+                page = None
+            else:
+                page = memcache.get('visitpage:%s' % page_key)
+                if page is None:
+                    page = self.render_page(user.email(), page_size)
+                    if page is None:
+                        return
+                    memcache.set('visitpage:%s' % page_key, page, time=PAGE_CACHE_SECONDS)
+            self.response.headers['ETag'] = etag
+            self.response.headers['Cache-Control'] = 'private, no-cache'
+            if page is None:
+                self.response.set_status(304)
+            else:
+                self.response.out.write(page)
+
+    def render_page(self, account, page_size):
+        """
+        Renders one page of the account's visits, or redirects to the first
+        page and returns None if the page boundary is invalid.
+        """
+        try:
+            before = get_page_boundary(self.request, 'before')
+            after = get_page_boundary(self.request, 'after')
+        except (ValueError, OverflowError):
+            self.redirect(visit_page_url(page_size))
+            return None
+        visits, has_newer, has_older = visit_page(account, page_size, before, after)
+        if (not visits) and (not has_newer):
+            return "No visit records"
+        template_values = {'visit_records': visits}
+        page_links(template_values, visits, has_newer, has_older, page_size)
+        return template.render('mainpage.html', template_values)
+
+
+class SearchHandler(webapp.RequestHandler):
+    """
+    Visits whose avatar name (or a word in it) starts with the name
+    parameter, newest first, one page at a time, paged like the main page
+    (see visit_page).  Pages continue into the archived visits once the
+    matching visit records run out.
+    """
+    def get(self):
+        user = users.get_current_user()
+        if not user:
+            self.redirect(users.create_login_url(self.request.uri))
+        else:
+            name = self.request.get('name')
+            prefix = normalize_name(name)[:MAX_NAME_PREFIX_LENGTH]
+            page_size = get_page_size(self.request)
+            template_values = {'name': name, 'visit_records': []}
+            if prefix:
+                try:
+                    before = get_page_boundary(self.request, 'before')
+                    after = get_page_boundary(self.request, 'after')
+                except (ValueError, OverflowError):
+                    self.redirect(visit_page_url(page_size, '/search', name=name))
+                    return
+                visits, has_newer, has_older = visit_page(user.email(), page_size, before, after, prefix)
+                template_values['visit_records'] = visits
+                page_links(template_values, visits, has_newer, has_older, page_size, '/search', name=name)
+            self.response.out.write(template.render('searchpage.html', template_values))
+
+
+def parse_datetime(value, end_of_day=False):
+    """
+    Datetime from a YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS parameter, or None if it
+    is missing.  A date alone means the start of the day, or the end of it if
+    end_of_day is set.  Raises ValueError if the value is invalid.
+    """
+    if not value:
+        return None
+    if len(value) == 10:
+        day = datetime.datetime.strptime(value, '%Y-%m-%d')
+        if end_of_day:
+            return day + datetime.timedelta(days=1, microseconds=-1)
+        return day
+    return datetime.datetime.strptime(value.replace(' ', 'T'), '%Y-%m-%dT%H:%M:%S')
+
+
+class ExportHandler(webapp.RequestHandler):
+    """
+    Exports the account's visits, oldest first, as CSV or NDJSON.  Accepts
+    'region', 'from' and 'to' (utc global_datetime range) filters, 'limit'
+    (visits to return) and 'cursor' (resume point from a previous export,
+    returned in the X-Cursor header while more visits remain).  Archived
+    visits come first, then the visit records, which are fetched in batches
+    with datastore cursors.  With 'gzip=1' the export is returned as a gzip
+    file.
+    """
+    def get(self, output_format=None):
+        user = users.get_current_user()
+        if not user:
+            self.redirect(users.create_login_url(self.request.uri))
+            return
+        output_format = output_format or self.request.get('format', 'csv')
+        if output_format not in ('csv', 'ndjson'):
+            output_format = 'csv'
+        try:
+            limit = int(self.request.get('limit', DEFAULT_EXPORT_LIMIT))
+            from_datetime = parse_datetime(self.request.get('from'))
+            to_datetime = parse_datetime(self.request.get('to'), True)
+        except ValueError:
+            self.error(400)
+            self.response.out.write("Invalid limit or date")
+            return
+        limit = max(1, min(limit, MAX_EXPORT_LIMIT))
+        region = self.request.get('region') or None
+        cursor = self.request.get('cursor')
+        archive_day = None
+        archive_index = 0
+        visit_query = self.build_query(user.email(), region, from_datetime, to_datetime)
+        try:
+            if cursor.startswith(ARCHIVE_CURSOR_PREFIX):
+                day, archive_index = cursor[len(ARCHIVE_CURSOR_PREFIX):].split(':')
+                archive_day = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+                archive_index = int(archive_index)
+            elif cursor.startswith(RECORD_CURSOR_PREFIX) and (len(cursor) > len(RECORD_CURSOR_PREFIX)):
+                visit_query.with_cursor(cursor[len(RECORD_CURSOR_PREFIX):])
+        except (ValueError, db.BadValueError):
+            self.error(400)
+            self.response.out.write("Invalid cursor")
+            return
+        self.output_format = output_format
+        if self.request.get('gzip'):
+            self.response.headers['Content-Type'] = 'application/x-gzip'
+            self.response.headers['Content-Disposition'] = 'attachment; filename=visits.%s.gz' % output_format
+            self.out = gzip.GzipFile(fileobj=self.response.out, mode='wb')
+        else:
+            if output_format == 'csv':
+                self.response.headers['Content-Type'] = 'text/csv'
             else:
-                self.response.out.write("No visit records")
+                self.response.headers['Content-Type'] = 'application/x-ndjson'
+            self.out = self.response.out
+        self.csv_writer = csv.writer(self.out, lineterminator='\n')
+        if (output_format == 'csv') and (not cursor):
+            self.csv_writer.writerow(EXPORT_COLUMNS)
+        written = 0
+        next_cursor = None
+        if not cursor.startswith(RECORD_CURSOR_PREFIX):
+            written, next_cursor = self.write_archived_visits(user.email(), region, from_datetime,
+                                                              to_datetime, archive_day,
+                                                              archive_index, limit)
+        if next_cursor is None:
+            next_cursor = self.write_visit_records(visit_query, limit - written)
+        if next_cursor is not None:
+            self.response.headers['X-Cursor'] = next_cursor
+        if self.out is not self.response.out:
+            self.out.close()
+
+    def write_visit(self, visit):
+        values = [visit['region'], visit['name'], visit['local_datetime'],
+                  visit['global_datetime'].isoformat()]
+        values = [(value or u'').encode('utf-8') for value in values]
+        if self.output_format == 'csv':
+            self.csv_writer.writerow(values)
+        else:
+            self.out.write(simplejson.dumps(dict(zip(EXPORT_COLUMNS, values))) + '\n')
+
+    def write_archived_visits(self, account, region, from_datetime, to_datetime, first_day, skip, limit):
+        """
+        Writes up to limit matching archived visits, skipping the first skip
+        visits of first_day (None starts at the oldest archive).  Returns the
+        number written and the cursor to resume from, or None once all
+        archived visits are written.
+        """
+        if (from_datetime is not None) and ((first_day is None) or (from_datetime.date() > first_day)):
+            first_day = from_datetime.date()
+            skip = 0
+        last_day = None
+        if to_datetime is not None:
+            last_day = to_datetime.date()
+        written = 0
+        for day, index, visit in iter_archived_visits(account, first_day, last_day, region, False):
+            if (day == first_day) and (index < skip):
+                continue
+            if (from_datetime is not None) and (visit['global_datetime'] < from_datetime):
+                continue
+            if (to_datetime is not None) and (visit['global_datetime'] > to_datetime):
+                continue
+            if written == limit:
+                return written, '%s%s:%d' % (ARCHIVE_CURSOR_PREFIX, day.isoformat(), index)
+            self.write_visit(visit)
+            written += 1
+        if written == limit:
+            #Resume with the visit records
+            return written, RECORD_CURSOR_PREFIX
+        return written, None
+
+    def build_query(self, account, region, from_datetime, to_datetime):
+        """
+        Query for the matching visit records, oldest first.
+        """
+        visit_query = VisitRecord.all().filter('account =', account)
+        if region is not None:
+            visit_query.filter('region =', region)
+        if from_datetime is not None:
+            visit_query.filter('global_datetime >=', from_datetime)
+        if to_datetime is not None:
+            visit_query.filter('global_datetime <=', to_datetime)
+        visit_query.order('global_datetime')
+        return visit_query
+
+    def write_visit_records(self, visit_query, limit):
+        """
+        Writes up to limit visit records from the query.  Returns the cursor
+        to resume from, or None once all records have been written.
+        """
+        cursor = ''
+        while limit > 0:
+            batch_size = min(EXPORT_BATCH_SIZE, limit)
+            visit_records = visit_query.fetch(batch_size)
+            for visit_record in visit_records:
+                self.write_visit({'region': visit_record.region,
+                                  'name': visit_record.name,
+                                  'local_datetime': visit_record.local_datetime,
+                                  'global_datetime': visit_record.global_datetime})
+            if len(visit_records) < batch_size:
+                #Reached the end of the log
+                return None
+            limit -= batch_size
+            cursor = visit_query.cursor()
+            visit_query.with_cursor(cursor)
+        return RECORD_CURSOR_PREFIX + cursor
 
 
 class LogVisitHandler(webapp.RequestHandler):
@@ -45,35 +1012,324 @@ class LogVisitHandler(webapp.RequestHandler):
     Accepts new records from the VisitLogger Region Module.
     """
     def get(self):
-        new_visit_record = VisitRecord()
-        new_visit_record.account = self.request.get('account')
-        new_visit_record.region = self.request.get('region')
-        new_visit_record.name = self.request.get('name')
-        new_visit_record.local_datetime = self.request.get('datetime')
-        new_visit_record.put()
+        visit = {'account': self.request.get('account'),
+                 'region': self.request.get('region'),
+                 'name': self.request.get('name'),
+                 'local_datetime': self.request.get('datetime'),
+                 'global_datetime': datetime.datetime.utcnow()}
+        if (VISIT_WRITE_MODE != 'buffered') or (not visit_buffer.append(visit)):
+            store_visits([visit])
+
+
+class FlushVisitBufferTask(webapp.RequestHandler):
+    """
+    Stores the visits waiting in the write-behind buffer.  Run by cron and by
+    the task queue when the buffer fills.
+    """
+    def get(self):
+        visit_buffer.flush(store_buffered_visits)
+
+    def post(self):
+        self.get()
 
 
 class ClearLogHandler(webapp.RequestHandler):
     """
-    Clears log records for a specific account.
+    Starts clearing the log records for a specific account.  The records are
+    deleted in the background by ClearLogTask, and visits still waiting in the
+    write-behind buffer from before the clear are dropped when flushed.  The
+    account moves to a new clear generation, so its visit counters and
+    sketches start again from zero at once.
     """
     def post(self):
         user = users.get_current_user()
         if not user:
             self.redirect(users.create_login_url(self.request.uri))
         else:
-            visit_records = db.GqlQuery("""SELECT * FROM VisitRecord WHERE
-                                        account=:1""", user.email())
-            if (visit_records.count(1) > 0):
-                for visit_record in visit_records:
-                    visit_record.delete()
+            generation = clear_generations([user.email()])[user.email()] + 1
+            clear_log_status = ClearLogStatus(key_name=clear_log_key_name(user.email()))
+            clear_log_status.generation = generation
+            clear_log_status.account = user.email()
+            clear_log_status.status = 'RUNNING'
+            clear_log_status.cutoff = datetime.datetime.utcnow()
+            clear_log_status.put()
+            invalidate_visit_log(user.email())
+            taskqueue.add(url='/tasks/clearlog', params={'account': user.email()})
             self.redirect('/')
 
 
+class ClearLogTask(webapp.RequestHandler):
+    """
+    Deletes log records in batches using keys-only queries, queuing itself
+    again until none are left.
+    """
+    def post(self):
+        account = self.request.get('account')
+        clear_log_status = ClearLogStatus.get_by_key_name(clear_log_key_name(account))
+        if (clear_log_status is None) or (clear_log_status.status != 'RUNNING'):
+            return
+        deleted = 0
+        for i in range(DELETE_BATCHES_PER_TASK):
+            visit_record_keys = db.GqlQuery("""SELECT __key__ FROM VisitRecord WHERE
+                                            account=:1 AND global_datetime<=:2
+                                            ORDER BY global_datetime DESC""",
+                                            account, clear_log_status.cutoff).fetch(DELETE_BATCH_SIZE)
+            if visit_record_keys:
+                db.delete(visit_record_keys)
+                deleted += len(visit_record_keys)
+                continue
+            #Archives only hold visits from whole days before the cutoff
+            archives = db.GqlQuery("""SELECT * FROM VisitArchive WHERE
+                                   account=:1 AND day<=:2 ORDER BY day DESC""",
+                                   account, clear_log_status.cutoff.date()).fetch(ARCHIVE_BATCH_SIZE)
+            if archives:
+                db.delete(archives)
+                deleted += sum([archive.visit_count for archive in archives])
+                continue
+            #Counters and sketches of earlier clear generations go once the
+            #records they counted are gone.  Those last updated before the
+            #cutoff are found by time (older shards may not have a generation),
+            #and any updated by a visit stored while the clear started by
+            #generation.
+            for summary_kind in ('VisitCounterShard', 'VisitorSketch'):
+                summary_keys = db.GqlQuery("""SELECT __key__ FROM %s WHERE
+                                           account=:1 AND updated<=:2""" % summary_kind,
+                                           account, clear_log_status.cutoff).fetch(DELETE_BATCH_SIZE)
+                if summary_keys:
+                    break
+                summary_keys = db.GqlQuery("""SELECT __key__ FROM %s WHERE
+                                           account=:1 AND generation<:2""" % summary_kind,
+                                           account, clear_log_status.generation).fetch(DELETE_BATCH_SIZE)
+                if summary_keys:
+                    break
+            if not summary_keys:
+                clear_log_status.status = 'DONE'
+                break
+            db.delete(summary_keys)
+        clear_log_status.deleted_count += deleted
+        clear_log_status.put()
+        if deleted:
+            invalidate_visit_log(account)
+        if clear_log_status.status == 'RUNNING':
+            taskqueue.add(url='/tasks/clearlog', params={'account': account})
+
+
+class CompactVisitsTask(webapp.RequestHandler):
+    """
+    Moves visit records from whole days more than VISIT_ARCHIVE_DAYS ago into
+    the daily archives and deletes them, queuing itself again until none are
+    left.  Run daily by cron.
+    """
+    def get(self):
+        cutoff = datetime.datetime.combine(datetime.datetime.utcnow().date() -
+                                           datetime.timedelta(VISIT_ARCHIVE_DAYS),
+                                           datetime.time())
+        for i in range(DELETE_BATCHES_PER_TASK):
+            visit_records = db.GqlQuery("""SELECT * FROM VisitRecord WHERE
+                                        global_datetime<:1 ORDER BY global_datetime""",
+                                        cutoff).fetch(DELETE_BATCH_SIZE)
+            if not visit_records:
+                return
+            accounts = archive_visit_records(visit_records)
+            db.delete(visit_records)
+            for account in accounts:
+                invalidate_visit_log(account)
+        taskqueue.add(url='/tasks/compactvisits')
+
+    def post(self):
+        self.get()
+
+
+def index_archive_names(archive_key):
+    """
+    Fills in the name prefixes of a daily archive.  Returns True if they
+    changed.  Run in a transaction.
+    """
+    archive = VisitArchive.get(archive_key)
+    if archive is None:
+        return False
+    prefixes = archive_name_prefixes(archive.get_visits())
+    if archive.name_prefixes == prefixes:
+        return False
+    archive.name_prefixes = prefixes
+    archive.put()
+    return True
+
+
+class IndexVisitNamesTask(webapp.RequestHandler):
+    """
+    Fills in the name prefixes of visit records and daily archives stored
+    before name search covered them, MIGRATE_BATCH_SIZE at a time, queuing
+    itself again with a cursor until every record and then every archive
+    ('kind=archives') has been checked.  Started by an administrator by url.
+    """
+    def get(self):
+        cursor = self.request.get('cursor')
+        if self.request.get('kind') == 'archives':
+            archive_query = VisitArchive.all(keys_only=True).order('__key__')
+            if cursor:
+                archive_query.with_cursor(cursor)
+            archive_keys = archive_query.fetch(MIGRATE_BATCH_SIZE)
+            updated_count = 0
+            for archive_key in archive_keys:
+                if db.run_in_transaction(index_archive_names, archive_key):
+                    updated_count += 1
+            if len(archive_keys) == MIGRATE_BATCH_SIZE:
+                taskqueue.add(url='/tasks/indexnames', params={'kind': 'archives',
+                                                               'cursor': archive_query.cursor()})
+            self.response.out.write('Updated %d of %d archives.' % (updated_count, len(archive_keys)))
+            return
+        visit_query = VisitRecord.all().order('__key__')
+        if cursor:
+            visit_query.with_cursor(cursor)
+        visit_records = visit_query.fetch(MIGRATE_BATCH_SIZE)
+        updated_records = []
+        for visit_record in visit_records:
+            prefixes = name_prefixes(visit_record.name or '')
+            if visit_record.name_prefixes != prefixes:
+                visit_record.name_prefixes = prefixes
+                updated_records.append(visit_record)
+        if updated_records:
+            db.put(updated_records)
+        if len(visit_records) == MIGRATE_BATCH_SIZE:
+            taskqueue.add(url='/tasks/indexnames', params={'cursor': visit_query.cursor()})
+        else:
+            #The records are done, so go on to the archives
+            taskqueue.add(url='/tasks/indexnames', params={'kind': 'archives'})
+        self.response.out.write('Updated %d of %d records.' % (len(updated_records), len(visit_records)))
+
+    def post(self):
+        self.get()
+
+
+class DashboardHandler(webapp.RequestHandler):
+    """
+    Visits per region per day and per avatar, read from the visit counters
+    rather than the log records.  Only the counters of the account's current
+    clear generation are counted.
+    """
+    def get(self):
+        user = users.get_current_user()
+        if not user:
+            self.redirect(users.create_login_url(self.request.uri))
+        else:
+            try:
+                days = int(self.request.get('days', DEFAULT_DASHBOARD_DAYS))
+            except ValueError:
+                days = DEFAULT_DASHBOARD_DAYS
+            days = max(1, min(days, MAX_DASHBOARD_DAYS))
+            first_day = datetime.datetime.utcnow().date() - datetime.timedelta(days - 1)
+            generation = clear_generations([user.email()])[user.email()]
+            region_counts = {}
+            region_shards = db.GqlQuery("""SELECT * FROM VisitCounterShard WHERE
+                                        account=:1 AND counter_type=:2 AND day>=:3""",
+                                        user.email(), 'region', first_day)
+            for shard in region_shards.run(batch_size=MAX_BATCH_PUT):
+                if shard.generation != generation:
+                    continue
+                key = (shard.day, shard.region)
+                region_counts[key] = region_counts.get(key, 0) + shard.count
+            avatar_counts = {}
+            avatar_shards = db.GqlQuery("""SELECT * FROM VisitCounterShard WHERE
+                                        account=:1 AND counter_type=:2""",
+                                        user.email(), 'avatar')
+            for shard in avatar_shards.run(batch_size=MAX_BATCH_PUT):
+                if shard.generation != generation:
+                    continue
+                avatar_counts[shard.name] = avatar_counts.get(shard.name, 0) + shard.count
+            #Newest days first, busiest avatars first
+            region_rows = [{'day': day, 'region': region, 'count': count}
+                           for (day, region), count in region_counts.items()]
+            region_rows.sort(key=lambda row: (row['day'], row['region']))
+            region_rows.reverse()
+            avatar_rows = [{'name': name, 'count': count}
+                           for name, count in avatar_counts.items()]
+            avatar_rows.sort(key=lambda row: (-row['count'], row['name']))
+            template_values = {'days': days,
+                               'region_counts': region_rows,
+                               'avatar_counts': avatar_rows}
+            self.response.out.write(template.render('dashboard.html', template_values))
+
+
+def parse_day(value, default):
+    """
+    Date from a YYYY-MM-DD parameter, or default if it is missing or invalid.
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return default
+
+
+class UniqueVisitorsHandler(webapp.RequestHandler):
+    """
+    Estimated number of distinct avatars per region and overall between the
+    start and end days (inclusive, default the last 30 days), optionally
+    limited to the given regions.  Read from the unique visitor sketches of
+    the account's current clear generation.
+    """
+    def get(self):
+        user = users.get_current_user()
+        if not user:
+            self.redirect(users.create_login_url(self.request.uri))
+        else:
+            today = datetime.datetime.utcnow().date()
+            end_day = parse_day(self.request.get('end'), today)
+            start_day = parse_day(self.request.get('start'),
+                                  end_day - datetime.timedelta(DEFAULT_DASHBOARD_DAYS - 1))
+            regions = [region for region in self.request.get_all('region') if region]
+            generation = clear_generations([user.email()])[user.email()]
+            sketches = db.GqlQuery("""SELECT * FROM VisitorSketch WHERE
+                                   account=:1 AND day>=:2 AND day<=:3""",
+                                   user.email(), start_day, end_day)
+            region_registers = {}
+            total_registers = new_sketch()
+            for sketch in sketches.run(batch_size=MAX_BATCH_PUT):
+                if sketch.generation != generation:
+                    continue
+                if regions and (sketch.region not in regions):
+                    continue
+                if sketch.region not in region_registers:
+                    region_registers[sketch.region] = new_sketch()
+                registers = array.array('B', sketch.registers)
+                merge_sketches(region_registers[sketch.region], registers)
+                merge_sketches(total_registers, registers)
+            self.response.headers['Content-Type'] = 'text/plain'
+            for region in sorted(region_registers.keys()):
+                self.response.out.write("%s,%d\n" % (region, estimate_sketch(region_registers[region])))
+            self.response.out.write("TOTAL,%d\n" % estimate_sketch(total_registers))
+
+
+class ClearLogStatusHandler(webapp.RequestHandler):
+    """
+    Reports the progress of clearing the log records for the current account.
+    """
+    def get(self):
+        user = users.get_current_user()
+        if not user:
+            self.redirect(users.create_login_url(self.request.uri))
+        else:
+            clear_log_status = ClearLogStatus.get_by_key_name(clear_log_key_name(user.email()))
+            if clear_log_status is None:
+                self.response.out.write("NONE\n0")
+            else:
+                self.response.out.write("%s\n%s" % (clear_log_status.status,
+                                                    clear_log_status.deleted_count))
+
+
 def main():
     application = webapp.WSGIApplication([('/', MainHandler),
                                           ('/logvisit', LogVisitHandler),
-                                          ('/clearlog', ClearLogHandler)],
+                                          ('/search', SearchHandler),
+                                          (r'/export(?:\.(csv|ndjson))?', ExportHandler),
+                                          ('/dashboard', DashboardHandler),
+                                          ('/uniquevisitors', UniqueVisitorsHandler),
+                                          ('/clearlog', ClearLogHandler),
+                                          ('/clearlog/status', ClearLogStatusHandler),
+                                          ('/tasks/clearlog', ClearLogTask),
+                                          ('/tasks/flushvisits', FlushVisitBufferTask),
+                                          ('/tasks/compactvisits', CompactVisitsTask),
+                                          ('/tasks/indexnames', IndexVisitNamesTask)],
                                          debug=True)
     run_wsgi_app(application)
 
@@ -29,7 +29,16 @@ import cgi
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
 from google.appengine.ext import db
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from django.utils import simplejson
+import array
+import calendar
+import datetime
+import hashlib
+import struct
 import time
+import urllib
 
 
 class HtmlPage():
@@ -80,7 +89,7 @@ class LogOrParametersPage(webapp.RequestHandler):
 
 class SimulationLogObject(db.Model):
     """
-    Record class representing the log output from a single step of a community simulation.  Includes a timestamp in case a single step was visualized multiple times and a region tag in case the same simulation id was used on more than one region.
+    Record class representing the log output from a single step of a community simulation.  Includes a timestamp in case a single step was visualized multiple times and a region tag in case the same simulation id was used on more than one region.  Keyed by step_key_name, so a step that is visualized again replaces the earlier record (which is kept in previous_data if LOG_STEP_HISTORY allows).  Records logged before steps were keyed, or without an integer step, have datastore-assigned ids.
     """
     # Time record was created
     time_stamp = db.DateTimeProperty(auto_now_add=True)
@@ -94,25 +103,889 @@ class SimulationLogObject(db.Model):
     # CSV string of simulation step and counts for each species
     data = db.StringProperty()
 
+    # Earlier CSV strings logged for this step, each followed by the time it was logged, most recent first.  At most LOG_STEP_HISTORY are kept.
+    previous_data = db.StringListProperty()
+
+    # The values in data as integers, so records can be filtered by step and count.  None for records logged before these were added until MigrateLogTask has run.
+    step = db.IntegerProperty()
+    gaps = db.IntegerProperty()
+    species1 = db.IntegerProperty()
+    species2 = db.IntegerProperty()
+    species3 = db.IntegerProperty()
+    species4 = db.IntegerProperty()
+    species5 = db.IntegerProperty()
+
+    def set_columns(self, values):
+        """
+        Sets the integer columns from a list of 7 integers parsed from data.
+        """
+        for column, value in zip(LOG_COLUMNS, values):
+            setattr(self, column, value)
+
+    def column_values(self):
+        """
+        Returns the integer columns as a list.
+        """
+        return [getattr(self, column) for column in LOG_COLUMNS]
+
+    def data_with_time(self):
+        """
+        Returns the CSV string followed by the time it was logged, as kept in previous_data.
+        """
+        return '%s,%s' % (self.data, str(self.time_stamp))
+
+    def add_previous(self, earlier_record):
+        """
+        Adds an earlier record for the same step to the front of previous_data, keeping at most LOG_STEP_HISTORY versions.
+        """
+        self.previous_data = ([earlier_record.data_with_time()] + self.previous_data)[:LOG_STEP_HISTORY]
+
+
+class SimulationLogChunk(db.Model):
+    """
+    Record class holding the log output from a range of LOG_CHUNK_SIZE consecutive steps of a community simulation, packed as integers.  Each row holds the step, the gap count, the counts for each of the 5 species and the time the step was logged (seconds since the epoch).  Rows are kept in step order, with one row per step: a step that is visualized again replaces its earlier row.  All chunks for a simulation id and region tag share the same parent key (see simulation_log_key) so they can be updated in a single transaction.  Used instead of SimulationLogObject when LOG_STORAGE_MODE is 'packed'.
+    """
+    # Simulation ID of the simulation that created this record
+    sim_id = db.StringProperty()
+
+    #Region tag of the opensim region that created this record
+    region_tag = db.StringProperty()
+
+    # Index of the range of steps held in this chunk (step // LOG_CHUNK_SIZE)
+    chunk_index = db.IntegerProperty()
+
+    # Number of rows packed into this chunk
+    row_count = db.IntegerProperty(default=0)
+
+    # Rows of little-endian 32-bit integers, LOG_ROW_FIELDS per row
+    rows = db.BlobProperty()
+
+    # Time the chunk was last updated
+    time_stamp = db.DateTimeProperty(auto_now=True)
+
+    def unpack_rows(self):
+        """
+        Returns the rows in this chunk as a list of lists of integers.
+        """
+        return unpack_int_rows(self.rows, LOG_ROW_FIELDS)
+
+    def set_rows(self, rows):
+        """
+        Replaces the rows in this chunk with a list of rows.
+        """
+        self.rows = db.Blob(pack_int_rows(rows))
+        self.row_count = len(rows)
+
+    def add_rows(self, rows):
+        """
+        Adds a list of rows to this chunk in step order, replacing any earlier rows for the same steps.  Returns True if an earlier row was replaced by one with different counts.
+        """
+        latest_rows = {}
+        for row in rows:
+            latest_rows[row[0]] = row
+        kept_rows = []
+        changed = False
+        for row in self.unpack_rows():
+            if (row[0] not in latest_rows):
+                kept_rows.append(row)
+            elif (row[1:7] != latest_rows[row[0]][1:7]):
+                changed = True
+        self.set_rows(sorted(kept_rows + list(latest_rows.values())))
+        return changed
+
+
+class SimulationLogRollup(db.Model):
+    """
+    Record class holding the smallest and largest counts logged in fixed-width buckets of steps, for up to ROLLUP_BUCKETS_PER_RECORD consecutive buckets of one bucket width.  Used to draw downsampled plots of long simulations without reading every step.  Stored as children of the SimulationLogSummary key of the simulation (see summary_key), so the summary and its rollups can be reset in a single transaction.
+    """
+    # Number of steps in each bucket (one of ROLLUP_WIDTHS)
+    width = db.IntegerProperty()
+
+    # Rows of little-endian 32-bit integers, ROLLUP_ROW_FIELDS per bucket: bucket index, number of steps logged, minimum gap and species counts, maximum gap and species counts
+    buckets = db.BlobProperty()
+
+    def unpack_buckets(self):
+        """
+        Returns the buckets in this record as a dictionary of rows keyed by bucket index.
+        """
+        buckets = {}
+        for row in unpack_int_rows(self.buckets, ROLLUP_ROW_FIELDS):
+            buckets[row[0]] = row
+        return buckets
+
+    def pack_buckets(self, buckets):
+        """
+        Stores a dictionary of bucket rows keyed by bucket index.
+        """
+        self.buckets = db.Blob(pack_int_rows([buckets[index] for index in sorted(buckets.keys())]))
+
+
+class LogDeletionStatus(db.Model):
+    """
+    Record class tracking the background deletion of the log records of a simulation id in a region.  Keyed by simulation_key_name.
+    """
+    sim_id = db.StringProperty()
+
+    region_tag = db.StringProperty()
+
+    # RUNNING while records are being deleted, DONE when finished
+    status = db.StringProperty()
+
+    # Records logged up to this time are deleted.  Records logged after the deletion was requested are kept.
+    cutoff = db.DateTimeProperty()
+
+    # Number of records deleted so far
+    deleted_count = db.IntegerProperty(default=0)
+
+    # Time the status was last updated
+    time_stamp = db.DateTimeProperty(auto_now=True)
+
+
+class SimulationLogSummary(db.Model):
+    """
+    Record class holding summary statistics for the log of a simulation id in a region, updated each time steps are logged.  Only the first counts logged for each step are counted, so a step logged again with different counts queues RebuildLogSummaryTask to rebuild the summary and rollups from the records.  Keyed by simulation_key_name.  The per-column lists hold one value for the gap count and one for each of the 5 species.
+    """
+    sim_id = db.StringProperty()
+
+    region_tag = db.StringProperty()
+
+    # Number of steps logged (a step visualized more than once is counted once)
+    step_count = db.IntegerProperty(default=0)
+
+    # Bitmap of the steps counted so far (bit step % 8 of byte step // 8), so a step logged again is skipped
+    logged_steps = db.BlobProperty()
+
+    # Lowest and highest step logged
+    first_step = db.IntegerProperty()
+    last_step = db.IntegerProperty()
+
+    # Smallest, largest and total counts logged for each column
+    minimums = db.ListProperty(int)
+    maximums = db.ListProperty(int)
+    totals = db.ListProperty(int)
+
+    # Counts logged for the highest step
+    finals = db.ListProperty(int)
+
+    # Lowest step at which each species had a count of 0 (-1 if it never did)
+    extinction_steps = db.ListProperty(int)
+
+    # Lowest step at which the gap count was highest
+    gap_peak_step = db.IntegerProperty()
+
+    # Time the summary was last updated
+    time_stamp = db.DateTimeProperty(auto_now=True)
+
+    def add_rows(self, rows):
+        """
+        Updates the statistics with a list of rows of 7 integers (step, gap count and 5 species counts).  Rows for steps that were already counted are skipped, so replays of a simulation count each step once.  Returns the rows that were counted.
+        """
+        logged_steps = array.array('B', self.logged_steps or '')
+        added_rows = []
+        for row in rows:
+            step = row[0]
+            counts = row[1:]
+            byte, bit = divmod(step, 8)
+            if (byte >= len(logged_steps)):
+                logged_steps.extend([0] * (byte + 1 - len(logged_steps)))
+            if (logged_steps[byte] & (1 << bit)):
+                continue
+            logged_steps[byte] |= 1 << bit
+            added_rows.append(row)
+            if (self.step_count == 0):
+                self.first_step = step
+                self.last_step = step
+                self.minimums = list(counts)
+                self.maximums = list(counts)
+                self.totals = [0] * len(counts)
+                self.finals = list(counts)
+                self.extinction_steps = [-1] * (len(counts) - 1)
+                self.gap_peak_step = step
+            self.step_count += 1
+            self.first_step = min(self.first_step, step)
+            if (step >= self.last_step):
+                self.last_step = step
+                self.finals = list(counts)
+            if ((counts[0] > self.maximums[0]) or ((counts[0] == self.maximums[0]) and (step < self.gap_peak_step))):
+                self.gap_peak_step = step
+            for i, count in enumerate(counts):
+                self.minimums[i] = min(self.minimums[i], count)
+                self.maximums[i] = max(self.maximums[i], count)
+                self.totals[i] += count
+            for species in range(1, len(counts)):
+                if ((counts[species] == 0) and
+                    ((self.extinction_steps[species - 1] == -1) or (step < self.extinction_steps[species - 1]))):
+                    self.extinction_steps[species - 1] = step
+        self.logged_steps = db.Blob(logged_steps.tostring())
+        return added_rows
+
+
+class WriteBehindBuffer():
+    """
+    Memcache-backed buffer of pending datastore writes.  Each appended payload gets its own numbered slot, and flush() hands the payloads to a store function in batches, in the order they were appended.  Payloads are lost if memcache evicts them before they are flushed, so this trades durability for request latency.  Slot numbers carry the generation of the counter (see generation_start), so a counter that memcache evicted starts again in fresh slots.  The same class is used by the visitloggerga app, which is deployed separately, so the two copies are kept identical.
+    """
+    def __init__(self, name, flush_url, flush_threshold):
+        self.name = name
+        self.flush_url = flush_url
+        self.flush_threshold = flush_threshold
+
+    def slot_key(self, slot):
+        return '%s:%d' % (self.name, slot)
+
+    def append(self, payload):
+        """
+        Adds a payload to the buffer, queuing a flush once flush_threshold payloads have been added.  Returns False if memcache could not accept it.
+        """
+        slot = memcache.incr(self.name + ':count', initial_value=self.generation_start())
+        if ((slot is None) or (not memcache.set(self.slot_key(slot), payload))):
+            return False
+        if ((slot % (1 << BUFFER_GENERATION_SHIFT)) % self.flush_threshold == 0):
+            taskqueue.add(url=self.flush_url)
+        return True
+
+    def flush(self, store):
+        """
+        Passes the buffered payloads to store in lists of up to BUFFER_FLUSH_BATCH_SIZE, removing them from the buffer once stored.  Only one flush runs at a time.  Returns the number of payloads stored.
+        """
+        if (not memcache.add(self.name + ':lock', 1, time=BUFFER_LOCK_SECONDS)):
+            return 0
+        stored = 0
+        try:
+            last_slot = memcache.get(self.name + ':count') or 0
+            flushed_slot = memcache.get(self.name + ':flushed') or 0
+            generation = last_slot >> BUFFER_GENERATION_SHIFT
+            if ((flushed_slot >> BUFFER_GENERATION_SHIFT) != generation):
+                #The counter was evicted and a new generation has started.  Slots left in the old one are abandoned.
+                flushed_slot = generation << BUFFER_GENERATION_SHIFT
+            while (flushed_slot < last_slot):
+                slots = range(flushed_slot + 1, min(last_slot, flushed_slot + BUFFER_FLUSH_BATCH_SIZE) + 1)
+                keys = [self.slot_key(slot) for slot in slots]
+                buffered = memcache.get_multi(keys)
+                payloads = []
+                for slot, key in zip(slots, keys):
+                    if (key in buffered):
+                        payloads.append(buffered[key])
+                    elif ((slot > last_slot - BUFFER_IN_FLIGHT_SLOTS) and (not self.missing_slot_expired(slot))):
+                        #A recent slot may still be being written.  Leave it for the next flush.
+                        break
+                    flushed_slot = slot
+                if (payloads):
+                    store(payloads)
+                    stored += len(payloads)
+                memcache.delete_multi([self.slot_key(slot) for slot in slots if (slot <= flushed_slot)])
+                memcache.set(self.name + ':flushed', flushed_slot)
+                if (flushed_slot < slots[-1]):
+                    break
+        finally:
+            memcache.delete(self.name + ':lock')
+        return stored
+
+    def generation_start(self):
+        """
+        Returns the value a counter started now counts up from.  Its generation is the time in seconds wrapped to 24 bits, so two generations only share a number if they start a multiple of about 194 days apart.
+        """
+        return (int(time.time()) % (1 << 24)) << BUFFER_GENERATION_SHIFT
+
+    def missing_slot_expired(self, slot):
+        """
+        Returns True once a slot has been missing for BUFFER_MISSING_SLOT_SECONDS, so a slot whose payload memcache never accepted doesn't hold up the buffer.  Only the first missing slot a flush stops at is timed.
+        """
+        missing = memcache.get(self.name + ':missing')
+        now = time.time()
+        if ((missing is None) or (missing[0] != slot)):
+            memcache.set(self.name + ':missing', (slot, now))
+            return False
+        return (now - missing[1] >= BUFFER_MISSING_SLOT_SECONDS)
+
+
+# Where new log records are stored: 'entity' stores one SimulationLogObject per step, 'packed' appends steps to SimulationLogChunk records.  Records in either format are always read and deleted.
+LOG_STORAGE_MODE = 'entity'
+
+# Number of consecutive simulation steps held by one SimulationLogChunk
+LOG_CHUNK_SIZE = 500
+
+# Number of integers in a packed row (step, gaps, 5 species counts, time logged)
+LOG_ROW_FIELDS = 8
+
+# Bucket widths (in steps) of the rollups kept for downsampled plots, finest first
+ROLLUP_WIDTHS = [10, 100, 1000, 10000]
+
+# Number of buckets held by one SimulationLogRollup
+ROLLUP_BUCKETS_PER_RECORD = 500
+
+# Number of integers in a rollup bucket row (index, steps logged, 6 minimums, 6 maximums)
+ROLLUP_ROW_FIELDS = 14
+
+# Default and maximum number of points returned for each column by /getlog/series
+DEFAULT_SERIES_POINTS = 500
+MAX_SERIES_POINTS = 5000
+
+# Maximum number of records examined by a filtered export request before it returns a cursor
+MAX_EXPORT_SCAN = 20000
+
+# Maximum number of simulations and steps compared by one /compare request
+MAX_COMPARE_RUNS = 40
+MAX_COMPARE_STEPS = 5000
+
+# Number of records updated per round by MigrateLogTask
+MIGRATE_BATCH_SIZE = 100
+
+# Number of SimulationLogObject records read per round by RebuildLogSummaryTask (packed records are read one chunk per round)
+REBUILD_BATCH_SIZE = 500
+
+# Prefix marking export cursors that point into SimulationLogChunk records
+CHUNK_CURSOR_PREFIX = 'chunk:'
+
+# How region-facing log requests are stored: 'sync' stores steps before responding, 'buffered' adds them to the memcache write-behind buffer and responds immediately.  Buffered steps are lost if memcache evicts them before they are flushed.
+LOG_WRITE_MODE = 'sync'
+
+# Number of buffered requests that triggers a flush between the regular flushes run by cron
+LOG_BUFFER_FLUSH_THRESHOLD = 100
+
+# Number of buffered payloads read from memcache and stored per round when flushing
+BUFFER_FLUSH_BATCH_SIZE = 200
+
+# Missing slots this close to the end of the buffer may still be being written, so a flush stops at them instead of skipping them
+BUFFER_IN_FLIGHT_SLOTS = 20
+
+# Seconds a recent slot can be missing before a flush gives up waiting for it and skips it
+BUFFER_MISSING_SLOT_SECONDS = 60
+
+# Seconds before the lock held by a flush expires if the flush dies
+BUFFER_LOCK_SECONDS = 300
+
+# Bits of a buffer slot number that count slots within a generation.  The bits above hold the generation.
+BUFFER_GENERATION_SHIFT = 32
+
+# Number of earlier versions kept in SimulationLogObject.previous_data when a step is logged again.  0 keeps only the latest.
+LOG_STEP_HISTORY = 0
+
+# Maximum number of entities the datastore accepts in a single batch put
+MAX_BATCH_PUT = 500
+
+# Number of keys deleted per datastore round trip, and number of rounds per deletion task
+DELETE_BATCH_SIZE = 500
+DELETE_BATCHES_PER_TASK = 20
+
+# Number of records fetched per datastore round trip when exporting logs
+EXPORT_BATCH_SIZE = 200
+
+# Default and maximum number of records returned by a single export request
+DEFAULT_EXPORT_LIMIT = 5000
+MAX_EXPORT_LIMIT = 20000
+
+# Column names for exported log records
+LOG_COLUMNS = ['step', 'gaps', 'species1', 'species2', 'species3', 'species4', 'species5']
+
+
+# Write-behind buffer for log requests when LOG_WRITE_MODE is 'buffered'
+log_buffer = WriteBehindBuffer('logbuffer', '/tasks/flushlog', LOG_BUFFER_FLUSH_THRESHOLD)
+
+
+def is_valid_log_data(sim_id, data):
+    """
+    Returns True if a simulation id and a CSV step string are in the format sent by the region module (10 character id, 7 fields of data).
+    """
+    return ((len(sim_id) == 10) and (len(data.split(',')) == 7))
+
+
+def pack_int_rows(rows):
+    """
+    Packs a list of equal-length rows of integers into a string of little-endian 32-bit integers.
+    """
+    values = []
+    for row in rows:
+        values.extend(row)
+    return struct.pack('<%di' % len(values), *values)
+
+
+def unpack_int_rows(packed, fields):
+    """
+    Unpacks a string of little-endian 32-bit integers into a list of rows with the given number of fields.
+    """
+    packed = packed or ''
+    values = struct.unpack('<%di' % (len(packed) // 4), packed)
+    return [list(values[i:i + fields]) for i in range(0, len(values), fields)]
+
+
+def parse_log_data(data):
+    """
+    Returns the 7 values in a CSV step string as a list of non-negative integers, or None if they are not all non-negative integers.
+    """
+    try:
+        values = [int(value) for value in data.split(',')]
+    except ValueError:
+        return None
+    if ((len(values) != 7) or (min(values) < 0)):
+        return None
+    return values
+
+
+def simulation_key_name(sim_id, region_tag):
+    """
+    Returns the key name identifying the log of a simulation id in a region.  The simulation id always has 10 characters so the two parts can't be confused.
+    """
+    return 'log:%s:%s' % (sim_id, region_tag)
+
+
+def simulation_log_key(sim_id, region_tag):
+    """
+    Returns the parent key shared by the packed log chunks of a simulation id in a region.  No entity is stored under this key.
+    """
+    return db.Key.from_path('SimulationLog', simulation_key_name(sim_id, region_tag))
+
+
+def summary_key(sim_id, region_tag):
+    """
+    Returns the key of the SimulationLogSummary of a simulation id in a region, which is also the parent key of its SimulationLogRollup records.
+    """
+    return db.Key.from_path('SimulationLogSummary', simulation_key_name(sim_id, region_tag))
+
+
+def step_key_name(sim_id, region_tag, step):
+    """
+    Returns the key name of the SimulationLogObject for a step of a simulation id in a region.
+    """
+    return 'step:%s:%d:%s' % (sim_id, step, region_tag)
+
+
+def chunk_key_name(chunk_index):
+    """
+    Returns the key name of a SimulationLogChunk.  Zero-padded so that key order matches step order.
+    """
+    return 'chunk%06d' % chunk_index
+
+
+def log_data_status(sim_id, data):
+    """
+    Returns SUCCESS if a CSV step string can be stored in the current LOG_STORAGE_MODE, or FAILED if not.
+    """
+    if (is_valid_log_data(sim_id, data) and
+        ((LOG_STORAGE_MODE != 'packed') or (parse_log_data(data) is not None))):
+        return 'SUCCESS'
+    return 'FAILED'
+
+
+def store_log_data(sim_id, region_tag, lines, time_stamps=None):
+    """
+    Validates and stores a list of CSV step strings for a simulation id and region tag, using batched puts.  time_stamps optionally gives the time each step was logged (defaults to now).  Returns a list with a SUCCESS or FAILED status for each step.
+    """
+    if (time_stamps is None):
+        time_stamps = [datetime.datetime.utcnow()] * len(lines)
+    statuses = []
+    valid_lines = []
+    valid_time_stamps = []
+    for data, time_stamp in zip(lines, time_stamps):
+        status = log_data_status(sim_id, data)
+        if (status == 'SUCCESS'):
+            valid_lines.append(data)
+            valid_time_stamps.append(time_stamp)
+        statuses.append(status)
+    changed = False
+    if (LOG_STORAGE_MODE == 'packed'):
+        changed = store_packed_log_data(sim_id, region_tag, valid_lines, valid_time_stamps)
+    else:
+        for i in range(0, len(valid_lines), MAX_BATCH_PUT):
+            if (store_log_records(sim_id, region_tag, valid_lines[i:i + MAX_BATCH_PUT], valid_time_stamps[i:i + MAX_BATCH_PUT])):
+                changed = True
+    #The stored records keep the last counts sent for each step, so those are the ones counted
+    latest_rows = {}
+    for data in valid_lines:
+        row = parse_log_data(data)
+        if (row is not None):
+            latest_rows[row[0]] = row
+    add_log_statistics(sim_id, region_tag, [latest_rows[step] for step in sorted(latest_rows.keys())])
+    if (changed):
+        #The summary and rollups still hold the counts first logged for the replaced steps
+        taskqueue.add(url='/tasks/rebuildsummary', params={'sim_id': sim_id, 'region_tag': region_tag})
+    return statuses
+
+
+def store_log_records(sim_id, region_tag, lines, time_stamps):
+    """
+    Stores up to MAX_BATCH_PUT valid CSV step strings as SimulationLogObject records with a single batched put.  Each step replaces any earlier record for the same step, keeping up to LOG_STEP_HISTORY earlier versions.  Returns True if a stored record was replaced by one with different counts.
+    """
+    unkeyed_records = []
+    records_by_key_name = {}
+    for data, time_stamp in zip(lines, time_stamps):
+        values = parse_log_data(data)
+        if (values is None):
+            unkeyed_records.append(SimulationLogObject(sim_id=sim_id, region_tag=region_tag,
+                                                       data=data, time_stamp=time_stamp))
+            continue
+        key_name = step_key_name(sim_id, region_tag, values[0])
+        record = SimulationLogObject(key_name=key_name, sim_id=sim_id, region_tag=region_tag,
+                                     data=data, time_stamp=time_stamp)
+        record.set_columns(values)
+        if (key_name in records_by_key_name):
+            #The same step was sent more than once in this batch
+            earlier_record = records_by_key_name[key_name]
+            record.previous_data = earlier_record.previous_data
+            record.add_previous(earlier_record)
+        records_by_key_name[key_name] = record
+    changed = False
+    if (records_by_key_name):
+        key_names = list(records_by_key_name.keys())
+        for key_name, stored_record in zip(key_names, SimulationLogObject.get_by_key_name(key_names)):
+            if (stored_record is not None):
+                record = records_by_key_name[key_name]
+                if (parse_log_data(stored_record.data or '') != record.column_values()):
+                    changed = True
+                if (LOG_STEP_HISTORY > 0):
+                    history = record.previous_data + [stored_record.data_with_time()] + stored_record.previous_data
+                    record.previous_data = history[:LOG_STEP_HISTORY]
+    db.put(unkeyed_records + list(records_by_key_name.values()))
+    return changed
+
+
+def buffer_log_data(sim_id, region_tag, lines):
+    """
+    Validates a list of CSV step strings and adds the valid ones to the write-behind buffer, to be stored by the next flush.  Steps are stored immediately if memcache is unavailable.  Returns a list with a SUCCESS or FAILED status for each step.
+    """
+    statuses = [log_data_status(sim_id, data) for data in lines]
+    valid_lines = [data for data, status in zip(lines, statuses) if (status == 'SUCCESS')]
+    if (valid_lines):
+        payload = (sim_id, region_tag, valid_lines, datetime.datetime.utcnow())
+        if (not log_buffer.append(payload)):
+            store_log_data(sim_id, region_tag, valid_lines)
+    return statuses
+
+
+def store_or_buffer_log_data(sim_id, region_tag, lines):
+    """
+    Stores or buffers a list of CSV step strings according to LOG_WRITE_MODE.  Returns a list with a SUCCESS or FAILED status for each step.
+    """
+    if (LOG_WRITE_MODE == 'buffered'):
+        return buffer_log_data(sim_id, region_tag, lines)
+    return store_log_data(sim_id, region_tag, lines)
+
+
+def store_buffered_log_data(payloads):
+    """
+    Stores a list of buffered (sim_id, region_tag, lines, time stamp) payloads, grouping them by simulation id and region tag so each simulation is stored with batched puts.  Payloads buffered at or before the cutoff of a deletion of their log (see DeleteLogRecords) are dropped, since the deletion may already have finished.
+    """
+    groups = {}
+    for sim_id, region_tag, lines, time_stamp in payloads:
+        group = groups.setdefault((sim_id, region_tag), ([], []))
+        group[0].extend(lines)
+        group[1].extend([time_stamp] * len(lines))
+    group_ids = list(groups.keys())
+    deletions = LogDeletionStatus.get_by_key_name([simulation_key_name(sim_id, region_tag) for sim_id, region_tag in group_ids])
+    for (sim_id, region_tag), deletion in zip(group_ids, deletions):
+        lines, time_stamps = groups[(sim_id, region_tag)]
+        if (deletion is not None):
+            kept = [(data, time_stamp) for data, time_stamp in zip(lines, time_stamps) if (time_stamp > deletion.cutoff)]
+            lines = [data for data, time_stamp in kept]
+            time_stamps = [time_stamp for data, time_stamp in kept]
+        if (lines):
+            store_log_data(sim_id, region_tag, lines, time_stamps)
+
+
+def update_log_statistics(sim_id, region_tag, rows):
+    """
+    Adds rows of 7 integers to the SimulationLogSummary of a simulation id and region tag and to its SimulationLogRollup records, creating them if needed, with a single put.  Nothing is written if every step was already logged.  Run in a transaction (the rollups share the summary's entity group).
+    """
+    key_name = simulation_key_name(sim_id, region_tag)
+    summary = SimulationLogSummary.get_by_key_name(key_name)
+    if (summary is None):
+        summary = SimulationLogSummary(key_name=key_name, sim_id=sim_id, region_tag=region_tag)
+    #Steps already logged are left out of the rollups too, as the summary decides which steps are new
+    new_rows = summary.add_rows(rows)
+    if (new_rows):
+        db.put([summary] + updated_log_rollups(sim_id, region_tag, new_rows))
+
+
+def add_log_statistics(sim_id, region_tag, rows):
+    """
+    Adds rows of 7 integers (at most one per step) to the summary and rollups of a simulation id and region tag in one transaction.
+    """
+    if (rows):
+        db.run_in_transaction(update_log_statistics, sim_id, region_tag, rows)
+
+
+def reset_log_statistics(sim_id, region_tag):
+    """
+    Deletes the summary and up to MAX_BATCH_PUT rollups of a simulation id and region tag.  Returns the number of rollups deleted, so callers can repeat it until none are left.  Run in a transaction.
+    """
+    key = summary_key(sim_id, region_tag)
+    rollup_keys = SimulationLogRollup.all(keys_only=True).ancestor(key).fetch(MAX_BATCH_PUT)
+    db.delete([key] + rollup_keys)
+    return len(rollup_keys)
+
+
+def rollup_key(sim_id, region_tag, width, record_index):
+    """
+    Returns the key of the SimulationLogRollup holding a range of buckets of one width.
+    """
+    return db.Key.from_path('SimulationLogRollup', 'rollup%05d_%06d' % (width, record_index),
+                            parent=summary_key(sim_id, region_tag))
+
+
+def updated_log_rollups(sim_id, region_tag, rows):
+    """
+    Returns the SimulationLogRollup records of every bucket width for a simulation id and region tag covering rows of 7 integers, with the rows added, for the caller to put.  Run in a transaction.
+    """
+    rows_by_record = {}
+    for width in ROLLUP_WIDTHS:
+        for row in rows:
+            record_index = (row[0] // width) // ROLLUP_BUCKETS_PER_RECORD
+            rows_by_record.setdefault((width, record_index), []).append(row)
+    record_ids = sorted(rows_by_record.keys())
+    rollups = SimulationLogRollup.get([rollup_key(sim_id, region_tag, width, record_index) for width, record_index in record_ids])
+    for i, record_id in enumerate(record_ids):
+        width = record_id[0]
+        if (rollups[i] is None):
+            rollups[i] = SimulationLogRollup(key=rollup_key(sim_id, region_tag, width, record_id[1]), width=width)
+        buckets = rollups[i].unpack_buckets()
+        for row in rows_by_record[record_id]:
+            index = row[0] // width
+            counts = row[1:]
+            if (index in buckets):
+                bucket = buckets[index]
+                bucket[1] += 1
+                for column in range(6):
+                    bucket[2 + column] = min(bucket[2 + column], counts[column])
+                    bucket[8 + column] = max(bucket[8 + column], counts[column])
+            else:
+                buckets[index] = [index, 1] + list(counts) + list(counts)
+        rollups[i].pack_buckets(buckets)
+    return rollups
+
+
+def read_log_rollup(sim_id, region_tag, width, first_step, last_step):
+    """
+    Returns the rollup bucket rows of one width covering a range of steps, in step order.
+    """
+    first_record = (first_step // width) // ROLLUP_BUCKETS_PER_RECORD
+    last_record = (last_step // width) // ROLLUP_BUCKETS_PER_RECORD
+    keys = [rollup_key(sim_id, region_tag, width, record_index) for record_index in range(first_record, last_record + 1)]
+    rows = []
+    for rollup in SimulationLogRollup.get(keys):
+        if (rollup is not None):
+            buckets = rollup.unpack_buckets()
+            rows.extend([buckets[index] for index in sorted(buckets.keys())])
+    return rows
+
+
+def bucket_count(first_step, last_step, width):
+    """
+    Returns the number of buckets of a width covering a range of steps.  Buckets are aligned to multiples of the width, so a range that doesn't start on a bucket boundary can touch one more bucket than its length suggests.
+    """
+    return last_step // width - first_step // width + 1
+
+
+def merge_rollup_buckets(rows, factor):
+    """
+    Merges each run of factor consecutive rollup bucket rows into one, keeping the smallest minimums and the largest maximums.
+    """
+    merged = []
+    for row in rows:
+        index = row[0] // factor
+        if (merged and (merged[-1][0] == index)):
+            bucket = merged[-1]
+            bucket[1] += row[1]
+            for column in range(6):
+                bucket[2 + column] = min(bucket[2 + column], row[2 + column])
+                bucket[8 + column] = max(bucket[8 + column], row[8 + column])
+        else:
+            merged.append([index] + row[1:])
+    return merged
+
+
+def store_packed_log_data(sim_id, region_tag, lines, time_stamps):
+    """
+    Adds a list of valid CSV step strings, logged at a matching list of times, to the SimulationLogChunk records covering their steps, in a single transaction.  Returns True if an earlier row was replaced by one with different counts.
+    """
+    if (not lines):
+        return False
+    rows_by_chunk = {}
+    for data, time_stamp in zip(lines, time_stamps):
+        row = parse_log_data(data) + [calendar.timegm(time_stamp.utctimetuple())]
+        rows_by_chunk.setdefault(row[0] // LOG_CHUNK_SIZE, []).append(row)
+    parent = simulation_log_key(sim_id, region_tag)
+    chunk_indexes = sorted(rows_by_chunk.keys())
+    def add_rows():
+        keys = [db.Key.from_path('SimulationLogChunk', chunk_key_name(index), parent=parent) for index in chunk_indexes]
+        chunks = SimulationLogChunk.get(keys)
+        changed = False
+        for i, index in enumerate(chunk_indexes):
+            if (chunks[i] is None):
+                chunks[i] = SimulationLogChunk(parent=parent, key_name=chunk_key_name(index),
+                                               sim_id=sim_id, region_tag=region_tag, chunk_index=index)
+            if (chunks[i].add_rows(rows_by_chunk[index])):
+                changed = True
+        db.put(chunks)
+        return changed
+    return db.run_in_transaction(add_rows)
+
+
+def packed_log_query(sim_id, region_tag, first_chunk_index=0, keys_only=False):
+    """
+    Returns a query for the SimulationLogChunk records of a simulation id and region tag in step order, starting at a chunk index.
+    """
+    parent = simulation_log_key(sim_id, region_tag)
+    query = SimulationLogChunk.all(keys_only=keys_only).ancestor(parent).order('__key__')
+    if (first_chunk_index > 0):
+        query.filter('__key__ >=', db.Key.from_path('SimulationLogChunk', chunk_key_name(first_chunk_index), parent=parent))
+    return query
+
+
+def packed_row_data(row):
+    """
+    Returns the CSV step string and time stamp for a packed row.
+    """
+    return (','.join([str(value) for value in row[:7]]), datetime.datetime.utcfromtimestamp(row[7]))
+
+
+def iter_log_records(sim_id, region_tag):
+    """
+    Yields the CSV step string and time stamp of every log record for a simulation id and region tag.  SimulationLogObject records come first in step order (so a step visualized again stays in place), followed by packed records in step order.  Records without an integer step come before the others, and records logged before the integer columns were added are only included after MigrateLogTask has run.
+    """
+    records = db.GqlQuery("SELECT * FROM SimulationLogObject WHERE sim_id=:1 AND region_tag=:2 ORDER BY step", sim_id, region_tag)
+    for record in records:
+        yield (record.data, record.time_stamp)
+    for chunk in packed_log_query(sim_id, region_tag):
+        for row in chunk.unpack_rows():
+            yield packed_row_data(row)
+
+
+def delete_log_batch(sim_id, region_tag, cutoff):
+    """
+    Deletes up to DELETE_BATCH_SIZE log records for a simulation id and region tag that were logged at or before the cutoff time.  Returns the number of records found and the number deleted.  None are found once none are left.
+    """
+    query = SimulationLogObject.all(keys_only=True)
+    query.filter('sim_id =', sim_id)
+    query.filter('region_tag =', region_tag)
+    query.filter('time_stamp <=', cutoff)
+    keys = query.fetch(DELETE_BATCH_SIZE)
+    if (keys):
+        #Records keyed by step may have been replaced by a replay since the (eventually consistent) index was updated, so their time stamps are checked again before deleting them
+        unkeyed = [key for key in keys if (key.name() is None)]
+        db.delete(unkeyed)
+        deleted = len(unkeyed)
+        for key in keys:
+            if (key.name() is not None):
+                deleted += db.run_in_transaction(delete_step_record, key, cutoff)
+        return len(keys), deleted
+    #Packed records are few, so remove their old rows one chunk at a time
+    cutoff_seconds = calendar.timegm(cutoff.utctimetuple())
+    for chunk_key in packed_log_query(sim_id, region_tag, keys_only=True):
+        deleted = db.run_in_transaction(prune_packed_chunk, chunk_key, cutoff_seconds)
+        if (deleted > 0):
+            return deleted, deleted
+    return 0, 0
+
+
+def delete_step_record(key, cutoff):
+    """
+    Deletes a SimulationLogObject if it was logged at or before the cutoff time.  Returns the number of records deleted.  Run in a transaction.
+    """
+    record = SimulationLogObject.get(key)
+    if ((record is None) or (record.time_stamp > cutoff)):
+        return 0
+    record.delete()
+    return 1
+
+
+def prune_packed_chunk(chunk_key, cutoff_seconds):
+    """
+    Removes the rows logged at or before the cutoff time (seconds since the epoch) from a SimulationLogChunk, deleting it if no rows are left.  Returns the number of rows removed.  Run in a transaction.
+    """
+    chunk = SimulationLogChunk.get(chunk_key)
+    if (chunk is None):
+        return 0
+    rows = chunk.unpack_rows()
+    kept_rows = [row for row in rows if (row[7] > cutoff_seconds)]
+    if (not kept_rows):
+        chunk.delete()
+    elif (len(kept_rows) < len(rows)):
+        chunk.set_rows(kept_rows)
+        chunk.put()
+    return len(rows) - len(kept_rows)
+
+
+def get_range_parameters(request):
+    """
+    Returns the column ranges requested to filter exported records, as a dictionary of (minimum, maximum) pairs keyed by the index of the column in LOG_COLUMNS.  The step range is given by 'first_step' and 'last_step', and count ranges by '<column>_min' and '<column>_max' (for example species3_min=401).  Missing limits are None.
+    """
+    names = [('first_step', 'last_step')] + [('%s_min' % column, '%s_max' % column) for column in LOG_COLUMNS[1:]]
+    ranges = {}
+    for index, (minimum_name, maximum_name) in enumerate(names):
+        limits = []
+        for name in (minimum_name, maximum_name):
+            try:
+                limits.append(int(request.get(name)))
+            except ValueError:
+                limits.append(None)
+        if (limits != [None, None]):
+            ranges[index] = tuple(limits)
+    return ranges
+
+
+def values_in_ranges(values, ranges):
+    """
+    Returns True if a list of column values falls inside every (minimum, maximum) range of a dictionary keyed by column index.
+    """
+    for index, (minimum, maximum) in ranges.items():
+        value = values[index]
+        if ((value is None) or
+            ((minimum is not None) and (value < minimum)) or
+            ((maximum is not None) and (value > maximum))):
+            return False
+    return True
+
+
+def log_data_values(data):
+    """
+    Splits a CSV step string into a list of values, converting them to integers where possible.
+    """
+    values = []
+    for value in data.split(','):
+        try:
+            values.append(int(value))
+        except ValueError:
+            values.append(value)
+    return values
+
+
+def get_int_parameter(request, name, default, maximum=None):
+    """
+    Returns a non-negative integer request parameter, or the default if it is missing or invalid.  Values above the maximum are clamped to it.
+    """
+    try:
+        value = int(request.get(name, default))
+    except ValueError:
+        value = default
+    if (value < 0):
+        value = default
+    if ((maximum is not None) and (value > maximum)):
+        value = maximum
+    return value
+
 
 class AddLogRecord(webapp.RequestHandler):
     """
     Stores logged output from a community simulation.  Accessed by the opensim region module.
     """
     def get(self):
-        record = SimulationLogObject()
         sim_id = self.request.get('sim_id')
         region_tag = self.request.get('region_tag')
         data = self.request.get('data')
-        if ((len(sim_id) == 10) and (len(data.split(',')) == 7)):
-            record.sim_id = sim_id
-            record.region_tag = region_tag
-            record.data = data
-            record.put()
-            self.response.out.write('SUCCESS')
-        else:
-            #Send some return value to tell the region that this failed
-            self.response.out.write('FAILED')
+        #Sends FAILED to tell the region if this failed
+        self.response.out.write(store_or_buffer_log_data(sim_id, region_tag, [data])[0])
+
+
+class AddLogRecords(webapp.RequestHandler):
+    """
+    Stores logged output from many steps of a community simulation in one request.  The POST body carries a sim_id, a region_tag and one or more 'data' fields, each holding one or more newline-separated step strings.  Returns one SUCCESS or FAILED line per step, in the order they were sent.  Accessed by the opensim region module.
+    """
+    def post(self):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        lines = []
+        for data in self.request.get_all('data'):
+            lines.extend(data.split())
+        self.response.out.write('\n'.join(store_or_buffer_log_data(sim_id, region_tag, lines)))
 
 
 class LogFormPage(webapp.RequestHandler):
@@ -147,18 +1020,20 @@ class GetLogRecords(webapp.RequestHandler):
         self.response.out.write(page.header)
         sim_id = self.request.get('sim_id')
         region_tag = self.request.get('region_tag')
-        records = db.GqlQuery("SELECT * FROM SimulationLogObject WHERE sim_id=:1 AND region_tag=:2 ORDER BY time_stamp", sim_id, region_tag)
-        if (records.count(1) > 0):
-            self.response.out.write(self.record_output_label % (sim_id, region_tag))
-            for record in records:
-                self.response.out.write(self.record_output % (record.data, str(record.time_stamp)))
-        else:
+        has_records = False
+        for data, time_stamp in iter_log_records(sim_id, region_tag):
+            if (not has_records):
+                self.response.out.write(self.record_output_label % (sim_id, region_tag, urllib.quote(sim_id.encode('utf-8')), urllib.quote(region_tag.encode('utf-8'))))
+                has_records = True
+            self.response.out.write(self.record_output % (data, str(time_stamp)))
+        if (not has_records):
             self.response.out.write(self.no_records_output % (sim_id, region_tag))
         self.response.out.write(page.footer)
 
     record_output_label = """
         <p>
             <b>Records for %s in %s:</b>
+            (<a href="/getlog.csv?sim_id=%s&region_tag=%s">Download as CSV</a>)
         </p>
         <b>Simulation step, Gap count, Species1 count, Species2 count, Species3 count, Species4 count, Species5 count, Time stamp</b><br>
         """
@@ -168,19 +1043,470 @@ class GetLogRecords(webapp.RequestHandler):
     no_records_output = 'No records for %s in %s.'
 
 
+class ExportLogRecords(webapp.RequestHandler):
+    """
+    Exports the log records with a specific simulation id and region tag as CSV or NDJSON.  Records are fetched and written in fixed-size batches using datastore cursors, so the full result set is never held in memory.  Accepts 'start' (records to skip), 'limit' (records to return) and 'cursor' (resume point from a previous export).  When more records remain, the cursor to resume from is returned in the X-Cursor header.  SimulationLogObject records are exported first in step order, followed by packed records in step order (records logged before the integer columns were added are only included after MigrateLogTask has run).  Records can be filtered by step range and count ranges (see get_range_parameters).  The step range, or else the first count range, is answered by an indexed query and the remaining ranges are checked as records are read.  Filtered records come out ordered by the indexed column.  Accessed by analysis scripts by url.
+    """
+    def get(self, output_format):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        cursor = self.request.get('cursor')
+        start = get_int_parameter(self.request, 'start', 0)
+        limit = get_int_parameter(self.request, 'limit', DEFAULT_EXPORT_LIMIT, MAX_EXPORT_LIMIT)
+        self.output_format = output_format
+        self.ranges = get_range_parameters(self.request)
+        if (cursor):
+            #The cursor already accounts for any records skipped by the original request
+            start = 0
+        if (output_format == 'csv'):
+            self.response.headers['Content-Type'] = 'text/csv'
+            if (not cursor):
+                self.response.out.write(','.join(LOG_COLUMNS + ['time_stamp']) + '\n')
+        else:
+            self.response.headers['Content-Type'] = 'application/x-ndjson'
+        chunk_index = 0
+        row_index = 0
+        if (cursor.startswith(CHUNK_CURSOR_PREFIX)):
+            chunk_index, row_index = [int(value) for value in cursor[len(CHUNK_CURSOR_PREFIX):].split(':')]
+        else:
+            written, skipped, next_cursor = self.write_records(sim_id, region_tag, cursor, start, limit)
+            if (next_cursor):
+                self.response.headers['X-Cursor'] = next_cursor
+                return
+            start -= skipped
+            limit -= written
+        if (limit > 0):
+            next_cursor = self.write_packed_records(sim_id, region_tag, chunk_index, row_index, start, limit)
+            if (next_cursor):
+                self.response.headers['X-Cursor'] = next_cursor
+
+    def build_query(self, sim_id, region_tag):
+        """
+        Returns a query for the SimulationLogObject records to export, and the column ranges that still have to be checked as records are read.
+        """
+        query = SimulationLogObject.all()
+        query.filter('sim_id =', sim_id)
+        query.filter('region_tag =', region_tag)
+        if (not self.ranges):
+            query.order('step')
+            return (query, {})
+        #Only one column can have inequality filters, so prefer the step
+        indexed_column = min(self.ranges.keys())
+        minimum, maximum = self.ranges[indexed_column]
+        name = LOG_COLUMNS[indexed_column]
+        if (minimum is not None):
+            query.filter('%s >=' % name, minimum)
+        if (maximum is not None):
+            query.filter('%s <=' % name, maximum)
+        query.order(name)
+        remaining_ranges = dict(self.ranges)
+        del remaining_ranges[indexed_column]
+        return (query, remaining_ranges)
+
+    def write_records(self, sim_id, region_tag, cursor, start, limit):
+        """
+        Writes up to limit matching SimulationLogObject records after skipping start of them.  Returns the number of records written, the number skipped, and the cursor to resume from (None once all records have been written).
+        """
+        query, remaining_ranges = self.build_query(sim_id, region_tag)
+        if (cursor):
+            query.with_cursor(cursor)
+        skipped = start
+        offset = 0
+        if ((start > 0) and (not remaining_ranges)):
+            skipped = query.count(start)
+            if (skipped < start):
+                #There are fewer records than we were asked to skip
+                return (0, skipped, None)
+            offset = start
+            start = 0
+        written = 0
+        scanned = 0
+        while (written < limit):
+            if ((scanned >= MAX_EXPORT_SCAN) and (start == 0)):
+                return (written, skipped, query.cursor())
+            #Never fetch more than can be written, so the cursor can't pass unwritten matches
+            batch_size = min(EXPORT_BATCH_SIZE, limit - written)
+            records = query.fetch(batch_size, offset)
+            offset = 0
+            scanned += len(records)
+            for record in records:
+                if (remaining_ranges and (not values_in_ranges(record.column_values(), remaining_ranges))):
+                    continue
+                if (start > 0):
+                    start -= 1
+                    continue
+                self.write_record(record.data, record.time_stamp, record.previous_data)
+                written += 1
+            if (len(records) < batch_size):
+                #Reached the end of the log
+                return (written, skipped - start, None)
+            query.with_cursor(query.cursor())
+        return (written, skipped, query.cursor())
+
+    def write_packed_records(self, sim_id, region_tag, chunk_index, row_index, start, limit):
+        """
+        Writes up to limit matching packed records, starting at a row of a chunk and skipping start of them.  Returns the cursor to resume from, or None once all records have been written.
+        """
+        first_step, last_step = self.ranges.get(0, (None, None))
+        if (first_step is not None):
+            first_chunk_index = first_step // LOG_CHUNK_SIZE
+            if (first_chunk_index > chunk_index):
+                chunk_index = first_chunk_index
+                row_index = 0
+        for chunk in packed_log_query(sim_id, region_tag, chunk_index):
+            if ((last_step is not None) and (chunk.chunk_index * LOG_CHUNK_SIZE > last_step)):
+                break
+            if (chunk.chunk_index != chunk_index):
+                row_index = 0
+            if ((not self.ranges) and (start >= chunk.row_count - row_index)):
+                #Skip the whole chunk without unpacking it
+                start -= max(chunk.row_count - row_index, 0)
+                continue
+            rows = chunk.unpack_rows()
+            while ((row_index < len(rows)) and (limit > 0)):
+                row = rows[row_index]
+                row_index += 1
+                if (not values_in_ranges(row, self.ranges)):
+                    continue
+                if (start > 0):
+                    start -= 1
+                    continue
+                self.write_record(*packed_row_data(row))
+                limit -= 1
+            if (limit == 0):
+                if (row_index < len(rows)):
+                    return '%s%d:%d' % (CHUNK_CURSOR_PREFIX, chunk.chunk_index, row_index)
+                return '%s%d:0' % (CHUNK_CURSOR_PREFIX, chunk.chunk_index + 1)
+        return None
+
+    def write_record(self, data, time_stamp, previous_data=None):
+        if (self.output_format == 'csv'):
+            self.response.out.write(self.csv_output % (data, str(time_stamp)))
+        else:
+            values = dict(zip(LOG_COLUMNS, log_data_values(data)))
+            values['time_stamp'] = str(time_stamp)
+            if (previous_data):
+                #Earlier versions of this step, most recent first
+                values['previous'] = previous_data
+            self.response.out.write(simplejson.dumps(values) + '\n')
+
+    csv_output = '%s,%s\n'
+
+
+class CompareLogRecords(webapp.RequestHandler):
+    """
+    Returns the logs of several simulations side by side as CSV or JSON, with one row per step and one set of gap and species columns per simulation (empty where a simulation did not log that step).  Simulations are given as repeated sim_id and region_tag parameters, and the steps compared by 'first_step' and 'last_step' (at most MAX_COMPARE_STEPS).  The queries for every simulation are started before any results are read so their datastore calls run concurrently.  Steps are matched using the integer columns, so records logged before they were added are only included after MigrateLogTask has run.  Accessed by dashboards and analysis scripts by url.
+    """
+    def get(self, output_format):
+        runs = zip(self.request.get_all('sim_id'), self.request.get_all('region_tag'))[:MAX_COMPARE_RUNS]
+        first_step = get_int_parameter(self.request, 'first_step', 0)
+        last_step = get_int_parameter(self.request, 'last_step', first_step + MAX_COMPARE_STEPS - 1)
+        last_step = min(last_step, first_step + MAX_COMPARE_STEPS - 1)
+        pending = []
+        for sim_id, region_tag in runs:
+            query = SimulationLogObject.all()
+            query.filter('sim_id =', sim_id)
+            query.filter('region_tag =', region_tag)
+            query.filter('step >=', first_step)
+            query.filter('step <=', last_step)
+            query.order('step')
+            chunk_query = packed_log_query(sim_id, region_tag, first_step // LOG_CHUNK_SIZE)
+            #run() sends the first datastore call without waiting for it
+            pending.append((query.run(batch_size=EXPORT_BATCH_SIZE), chunk_query.run()))
+        counts_by_run = []
+        for records, chunks in pending:
+            counts = {}
+            for record in records:
+                counts[record.step] = record.column_values()[1:]
+            for chunk in chunks:
+                if (chunk.chunk_index * LOG_CHUNK_SIZE > last_step):
+                    break
+                for row in chunk.unpack_rows():
+                    if (first_step <= row[0] <= last_step):
+                        counts[row[0]] = row[1:7]
+            counts_by_run.append(counts)
+        all_steps = set()
+        for counts in counts_by_run:
+            all_steps.update(counts.keys())
+        steps = sorted(all_steps)
+        if (output_format == 'csv'):
+            self.response.headers['Content-Type'] = 'text/csv'
+            header = ['step']
+            for sim_id, region_tag in runs:
+                header.extend(['%s:%s:%s' % (sim_id, region_tag, column) for column in LOG_COLUMNS[1:]])
+            self.response.out.write(','.join(header) + '\n')
+            missing = [''] * (len(LOG_COLUMNS) - 1)
+            for step in steps:
+                row = [str(step)]
+                for counts in counts_by_run:
+                    row.extend([str(count) for count in counts.get(step, missing)])
+                self.response.out.write(','.join(row) + '\n')
+        else:
+            self.response.headers['Content-Type'] = 'application/json'
+            output = {'first_step': first_step, 'last_step': last_step, 'step': steps, 'runs': []}
+            for (sim_id, region_tag), counts in zip(runs, counts_by_run):
+                run = {'sim_id': sim_id, 'region_tag': region_tag}
+                for column, name in enumerate(LOG_COLUMNS[1:]):
+                    run[name] = [self.column_value(counts, step, column) for step in steps]
+                output['runs'].append(run)
+            self.response.out.write(simplejson.dumps(output))
+
+    def column_value(self, counts, step, column):
+        if (step in counts):
+            return counts[step][column]
+        return None
+
+
+class GetLogSummary(webapp.RequestHandler):
+    """
+    Returns the summary statistics for the log of a specific simulation id and region tag as JSON, read with a single get.  Logs recorded before summaries were kept have one once MigrateLogTask has run.  Accessed by dashboards by url.
+    """
+    def get(self):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        summary = SimulationLogSummary.get_by_key_name(simulation_key_name(sim_id, region_tag))
+        self.response.headers['Content-Type'] = 'application/json'
+        if (summary is None):
+            self.error(404)
+            self.response.out.write(simplejson.dumps({'sim_id': sim_id, 'region_tag': region_tag, 'step_count': 0}))
+            return
+        columns = LOG_COLUMNS[1:]
+        output = {
+            'sim_id': sim_id,
+            'region_tag': region_tag,
+            'step_count': summary.step_count,
+            'first_step': summary.first_step,
+            'last_step': summary.last_step,
+            'minimum': dict(zip(columns, summary.minimums)),
+            'maximum': dict(zip(columns, summary.maximums)),
+            'mean': dict(zip(columns, [total / float(summary.step_count) for total in summary.totals])),
+            'final': dict(zip(columns, summary.finals)),
+            'extinction_step': dict(zip(columns[1:], [self.optional_step(step) for step in summary.extinction_steps])),
+            'gap_peak_step': summary.gap_peak_step,
+            'time_stamp': str(summary.time_stamp)}
+        self.response.out.write(simplejson.dumps(output))
+
+    def optional_step(self, step):
+        if (step == -1):
+            return None
+        return step
+
+
+class GetLogSeries(webapp.RequestHandler):
+    """
+    Returns a downsampled series of the log of a specific simulation id and region tag as JSON, with at most 'points' values per column.  Each point covers a bucket of consecutive steps and holds the smallest and largest counts logged in it, so peaks and extinctions are not lost.  Long runs are read from the precomputed rollups, so the cost does not grow with the length of the run (logs recorded before rollups were kept have them once MigrateLogTask has run).  Short runs are returned step by step.  Accessed by dashboards by url.
+    """
+    def get(self):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        points = max(get_int_parameter(self.request, 'points', DEFAULT_SERIES_POINTS, MAX_SERIES_POINTS), 1)
+        self.response.headers['Content-Type'] = 'application/json'
+        summary = SimulationLogSummary.get_by_key_name(simulation_key_name(sim_id, region_tag))
+        if (summary is None):
+            self.error(404)
+            self.response.out.write(simplejson.dumps({'sim_id': sim_id, 'region_tag': region_tag, 'step': []}))
+            return
+        span = summary.last_step - summary.first_step + 1
+        if (span <= points):
+            width = 1
+            buckets = {}
+            for data, time_stamp in iter_log_records(sim_id, region_tag):
+                row = parse_log_data(data)
+                if (row is not None):
+                    #Keep the most recently logged counts for each step
+                    buckets[row[0]] = [row[0], 1] + row[1:] + row[1:]
+            rows = [buckets[step] for step in sorted(buckets.keys())]
+        else:
+            width = ROLLUP_WIDTHS[-1]
+            for rollup_width in ROLLUP_WIDTHS:
+                if (bucket_count(summary.first_step, summary.last_step, rollup_width) <= points):
+                    width = rollup_width
+                    break
+            rows = read_log_rollup(sim_id, region_tag, width, summary.first_step, summary.last_step)
+            #Merge buckets if even the widest rollup has too many points
+            factor = 1
+            while (bucket_count(summary.first_step, summary.last_step, width * factor) > points):
+                factor += 1
+            if (factor > 1):
+                rows = merge_rollup_buckets(rows, factor)
+                width *= factor
+        columns = LOG_COLUMNS[1:]
+        output = {
+            'sim_id': sim_id,
+            'region_tag': region_tag,
+            'bucket_width': width,
+            'step': [row[0] * width for row in rows],
+            'steps_logged': [row[1] for row in rows],
+            'minimum': {},
+            'maximum': {}}
+        for column, name in enumerate(columns):
+            output['minimum'][name] = [row[2 + column] for row in rows]
+            output['maximum'][name] = [row[8 + column] for row in rows]
+        self.response.out.write(simplejson.dumps(output))
+
+
 class DeleteLogRecords(webapp.RequestHandler):
     """
-    Deletes all log records with a specific simulation id and region tag.  Accessed by the opensim region module.
+    Starts deleting all log records with a specific simulation id and region tag.  The records are deleted in the background by DeleteLogTask, so this returns immediately.  Records logged after this request are kept, and steps still waiting in the write-behind buffer from before it are dropped when they are flushed.  /summary and /getlog/series keep covering the deleted steps until the deletion is done.  Accessed by the opensim region module.
     """
     def get(self):
         sim_id = self.request.get('sim_id')
         region_tag = self.request.get('region_tag')
-        records = db.GqlQuery("SELECT * FROM SimulationLogObject WHERE sim_id=:1 AND region_tag=:2", sim_id, region_tag)
-        if (records.count(1) > 0):
-            for record in records:
-                record.delete()
+        deletion = LogDeletionStatus(key_name=simulation_key_name(sim_id, region_tag))
+        deletion.sim_id = sim_id
+        deletion.region_tag = region_tag
+        deletion.status = 'RUNNING'
+        deletion.cutoff = datetime.datetime.utcnow()
+        deletion.put()
+        taskqueue.add(url='/tasks/deletelog', params={'sim_id': sim_id, 'region_tag': region_tag})
         self.response.out.write('SUCCESS')
 
+
+class DeleteLogTask(webapp.RequestHandler):
+    """
+    Deletes log records in batches using keys-only queries, queuing itself again until none are left.  The summary and rollups are then deleted in batches of MAX_BATCH_PUT rollups, and RebuildLogSummaryTask is queued to count the steps logged after the deletion was requested.  Accessed by the task queue.
+    """
+    def post(self):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        deletion = LogDeletionStatus.get_by_key_name(simulation_key_name(sim_id, region_tag))
+        if ((deletion is None) or (deletion.status != 'RUNNING')):
+            return
+        deleted = 0
+        for i in range(DELETE_BATCHES_PER_TASK):
+            batch_found, batch_deleted = delete_log_batch(sim_id, region_tag, deletion.cutoff)
+            if (batch_found > 0):
+                deleted += batch_deleted
+            elif (db.run_in_transaction(reset_log_statistics, sim_id, region_tag) < MAX_BATCH_PUT):
+                deletion.status = 'DONE'
+                break
+        deletion.deleted_count += deleted
+        deletion.put()
+        if (deletion.status == 'RUNNING'):
+            taskqueue.add(url='/tasks/deletelog', params={'sim_id': sim_id, 'region_tag': region_tag})
+        else:
+            #The summary and rollups were just reset, so the rebuild only has to add the remaining records back
+            taskqueue.add(url='/tasks/rebuildsummary', params={'sim_id': sim_id, 'region_tag': region_tag,
+                                                               'phase': 'records', 'cursor': ''})
+
+
+class FlushLogBufferTask(webapp.RequestHandler):
+    """
+    Stores the log records waiting in the write-behind buffer.  Accessed by cron and by the task queue when the buffer fills.
+    """
+    def get(self):
+        log_buffer.flush(store_buffered_log_data)
+
+    def post(self):
+        self.get()
+
+
+class MigrateLogTask(webapp.RequestHandler):
+    """
+    Fills in the integer columns of SimulationLogObject records logged before they were added, MIGRATE_BATCH_SIZE records at a time, queuing itself again with a cursor until every record has been checked.  Queues RebuildLogSummaryTask once per migration for each simulation id and region tag it finds, so logs recorded before summaries and rollups were kept get them too.  Started by an administrator by url.
+    """
+    def get(self):
+        query = SimulationLogObject.all().order('__key__')
+        cursor = self.request.get('cursor')
+        run = self.request.get('run') or str(int(time.time()))
+        if (cursor):
+            query.with_cursor(cursor)
+        records = query.fetch(MIGRATE_BATCH_SIZE)
+        updated_records = []
+        logs = set()
+        for record in records:
+            values = parse_log_data(record.data or '')
+            if ((values is not None) and (record.column_values() != values)):
+                record.set_columns(values)
+                updated_records.append(record)
+            logs.add((record.sim_id, record.region_tag))
+        if (updated_records):
+            db.put(updated_records)
+        for sim_id, region_tag in logs:
+            queue_log_rebuild(sim_id, region_tag, run)
+        if (len(records) == MIGRATE_BATCH_SIZE):
+            taskqueue.add(url='/tasks/migratelog', params={'cursor': query.cursor(), 'run': run})
+        self.response.out.write('Updated %d of %d records.' % (len(updated_records), len(records)))
+
+    def post(self):
+        self.get()
+
+
+def queue_log_rebuild(sim_id, region_tag, run):
+    """
+    Queues RebuildLogSummaryTask for a simulation id and region tag, unless it was already queued with the same run id.  The task is named after both, so the task queue drops the repeats.
+    """
+    name = 'rebuild-%s-%s' % (run, hashlib.md5(simulation_key_name(sim_id, region_tag).encode('utf-8')).hexdigest())
+    try:
+        taskqueue.add(name=name, url='/tasks/rebuildsummary', params={'sim_id': sim_id, 'region_tag': region_tag})
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+class RebuildLogSummaryTask(webapp.RequestHandler):
+    """
+    Rebuilds the summary and rollups of the log of a simulation id and region tag from its records, after a step was logged again with different counts or when MigrateLogTask finds records logged before summaries were kept.  The summary and rollups are deleted first, then the records are added back in key order (so records whose integer columns haven't been filled in yet are included), REBUILD_BATCH_SIZE SimulationLogObject records or one SimulationLogChunk at a time, queuing itself again with a cursor until every record has been read.  Steps logged while the rebuild runs are added as usual, and /summary and /getlog/series only cover the steps read so far until it finishes.  Records due to be deleted by a running deletion are left out.  Accessed by the task queue.
+    """
+    def post(self):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        cursor = self.request.get('cursor')
+        phase = self.request.get('phase') or 'reset'
+        deletion = LogDeletionStatus.get_by_key_name(simulation_key_name(sim_id, region_tag))
+        cutoff = None
+        if (deletion is not None):
+            cutoff = deletion.cutoff
+        if (phase == 'reset'):
+            while (db.run_in_transaction(reset_log_statistics, sim_id, region_tag) == MAX_BATCH_PUT):
+                pass
+            next_phase, next_cursor = 'records', ''
+        elif (phase == 'records'):
+            query = SimulationLogObject.all()
+            query.filter('sim_id =', sim_id)
+            query.filter('region_tag =', region_tag)
+            query.order('__key__')
+            if (cursor):
+                query.with_cursor(cursor)
+            records = query.fetch(REBUILD_BATCH_SIZE)
+            rows = []
+            for record in records:
+                if ((cutoff is None) or (record.time_stamp > cutoff)):
+                    row = parse_log_data(record.data or '')
+                    if (row is not None):
+                        rows.append(row)
+            add_log_statistics(sim_id, region_tag, rows)
+            if (len(records) == REBUILD_BATCH_SIZE):
+                next_phase, next_cursor = 'records', query.cursor()
+            else:
+                next_phase, next_cursor = 'packed', '0'
+        else:
+            chunk_index = int(cursor)
+            chunks = packed_log_query(sim_id, region_tag, chunk_index).fetch(1)
+            if (not chunks):
+                return
+            rows = chunks[0].unpack_rows()
+            if (cutoff is not None):
+                cutoff_seconds = calendar.timegm(cutoff.utctimetuple())
+                rows = [row for row in rows if (row[7] > cutoff_seconds)]
+            add_log_statistics(sim_id, region_tag, [row[:7] for row in rows])
+            next_phase, next_cursor = 'packed', str(chunks[0].chunk_index + 1)
+        taskqueue.add(url='/tasks/rebuildsummary', params={'sim_id': sim_id, 'region_tag': region_tag,
+                                                           'phase': next_phase, 'cursor': next_cursor})
+
+
+class LogDeletionStatusPage(webapp.RequestHandler):
+    """
+    Reports the progress of deleting the log records with a specific simulation id and region tag: a line with NONE, RUNNING or DONE, followed by a line with the number of records deleted.  Accessed by the opensim region module or by url.
+    """
+    def get(self):
+        sim_id = self.request.get('sim_id')
+        region_tag = self.request.get('region_tag')
+        deletion = LogDeletionStatus.get_by_key_name(simulation_key_name(sim_id, region_tag))
+        if (deletion is None):
+            self.response.out.write('NONE\n0')
+        else:
+            self.response.out.write('%s\n%s' % (deletion.status, deletion.deleted_count))
+
 """
 END SECTION: Community logging
 """
@@ -189,8 +1515,18 @@ END SECTION: Community logging
 application = webapp.WSGIApplication([
     ('/', LogFormPage),
     ('/addlog', AddLogRecord),
+    ('/addlogs', AddLogRecords),
     ('/getlog', GetLogRecords),
-    ('/deletelog', DeleteLogRecords)], debug=True)
+    (r'/getlog\.(csv|ndjson)', ExportLogRecords),
+    ('/getlog/series', GetLogSeries),
+    (r'/compare\.(csv|json)', CompareLogRecords),
+    ('/summary', GetLogSummary),
+    ('/deletelog', DeleteLogRecords),
+    ('/deletelog/status', LogDeletionStatusPage),
+    ('/tasks/deletelog', DeleteLogTask),
+    ('/tasks/flushlog', FlushLogBufferTask),
+    ('/tasks/migratelog', MigrateLogTask),
+    ('/tasks/rebuildsummary', RebuildLogSummaryTask)], debug=True)
 
 def main():
     run_wsgi_app(application)